@@ -5,13 +5,15 @@
 import json
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
+from sqlalchemy import event
 from forms import *
+from search import NgramIndex, PrefixIndex, SUGGEST_LIMIT, MAX_SUGGEST_LIMIT
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -29,6 +31,12 @@ db = SQLAlchemy(app)
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    # trigram index serving case-insensitive substring search on postgres,
+    # see sql/0001_name_trigram_search.sql for existing databases
+    __table_args__ = (
+        db.Index('venue_name_trgm_idx', 'name',
+                 postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -43,6 +51,10 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('artist_name_trgm_idx', 'name',
+                 postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -57,6 +69,134 @@ class Artist(db.Model):
 
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
+class Show(db.Model):
+    __tablename__ = 'Show'
+    # upcoming show counts join on the venue and filter on start_time
+    __table_args__ = (
+        db.Index('show_venue_start_time_idx', 'venue_id', 'start_time'),
+        db.Index('show_artist_start_time_idx', 'artist_id', 'start_time'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+
+    venue = db.relationship('Venue', backref=db.backref('shows', passive_deletes=True))
+    artist = db.relationship('Artist', backref=db.backref('shows', passive_deletes=True))
+
+# gin_trgm_ops comes with the pg_trgm extension
+event.listen(db.metadata, 'before_create', db.DDL(
+  'CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+#----------------------------------------------------------------------------#
+# Data access.
+#----------------------------------------------------------------------------#
+
+# in-memory name search where pg_trgm is not available, e.g. sqlite, and
+# prefix search for the type-ahead suggestions on every database
+name_indexes = {
+  Venue: [NgramIndex(), PrefixIndex()],
+  Artist: [NgramIndex(), PrefixIndex()],
+}
+
+@event.listens_for(db.session, 'after_flush')
+def track_name_changes(session, flush_context):
+  # applied to the name indexes once committed, dropped on rollback
+  changes = session.info.setdefault('name_changes', [])
+  for obj in session.new.union(session.dirty):
+    if type(obj) in name_indexes:
+      changes.append((type(obj), obj.id, obj.name))
+  for obj in session.deleted:
+    if type(obj) in name_indexes:
+      changes.append((type(obj), obj.id, None))
+
+@event.listens_for(db.session, 'after_commit')
+def apply_name_changes(session):
+  for model, id, name in session.info.pop('name_changes', []):
+    for index in name_indexes[model]:
+      if name is None:
+        index.remove(id)
+      else:
+        index.add(id, name)
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_name_changes(session):
+  session.info.pop('name_changes', None)
+
+def name_index(model, kind):
+  index = next(index for index in name_indexes[model] if isinstance(index, kind))
+  if index.expired:
+    index.load(db.session.query(model.id, model.name))
+  return index
+
+def upcoming_show_counts(model, show_column):
+  # (id, name, number of upcoming shows) of every row of model
+  return db.session.query(
+      model.id, model.name, db.func.count(Show.id)
+    ).outerjoin(Show, db.and_(
+      show_column == model.id, Show.start_time > db.func.now())
+    ).group_by(model.id, model.name)
+
+def search_by_name(model, show_column, term):
+  # case-insensitive substring search on names, each hit with its number of
+  # upcoming shows from the same query. postgres matches with ILIKE on the
+  # trigram index, other databases go through the in-memory n-gram index
+  query = upcoming_show_counts(model, show_column)
+  if db.engine.dialect.name == 'postgresql':
+    pattern = '%' + term.replace('/', '//').replace('%', '/%').replace('_', '/_') + '%'
+    rows = query.filter(model.name.ilike(pattern, escape='/')).all()
+  else:
+    ids = name_index(model, NgramIndex).search(term)
+    rows = []
+    # bounded chunks keep under the bind parameter limit of sqlite
+    for start in range(0, len(ids), 500):
+      rows.extend(query.filter(model.id.in_(ids[start:start + 500])))
+
+  rows.sort(key=lambda row: ((row[1] or '').lower(), row[0]))
+  return {
+    "count": len(rows),
+    "data": [{
+      "id": id,
+      "name": name,
+      "num_upcoming_shows": num_upcoming_shows,
+    } for id, name, num_upcoming_shows in rows]
+  }
+
+def suggest_names(model, prefix, limit):
+  return [{
+    "id": id,
+    "name": name,
+  } for id, name in name_index(model, PrefixIndex).search(prefix, limit)]
+
+def venue_areas():
+  # venues grouped by city and state with their number of upcoming shows,
+  # built from a single grouped query whatever the number of venues. The
+  # start_time filter belongs to the join so venues without upcoming shows
+  # are kept with a count of 0
+  rows = db.session.query(
+      Venue.city, Venue.state, Venue.id, Venue.name,
+      db.func.count(Show.id)
+    ).outerjoin(Show, db.and_(
+      Show.venue_id == Venue.id, Show.start_time > db.func.now())
+    ).group_by(Venue.city, Venue.state, Venue.id, Venue.name
+    ).order_by(Venue.state, Venue.city, Venue.name, Venue.id)
+
+  areas = []
+  for city, state, venue_id, name, num_upcoming_shows in rows:
+    if not areas or (areas[-1]['city'], areas[-1]['state']) != (city, state):
+      areas.append({
+        "city": city,
+        "state": state,
+        "venues": []
+      })
+    areas[-1]['venues'].append({
+      "id": venue_id,
+      "name": name,
+      "num_upcoming_shows": num_upcoming_shows,
+    })
+  return areas
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
@@ -79,50 +219,29 @@ app.jinja_env.filters['datetime'] = format_datetime
 def index():
   return render_template('pages/home.html')
 
+@app.route('/search/suggest')
+def search_suggest():
+  # type-ahead for the search boxes: artists and venues whose name, or one
+  # of its words, starts with q. Served from the in-memory prefix indexes,
+  # which only read the database on first use
+  prefix = request.args.get('q', '')
+  limit = min(max(request.args.get('limit', SUGGEST_LIMIT, type=int), 0), MAX_SUGGEST_LIMIT)
+  return jsonify({
+    "artists": suggest_names(Artist, prefix, limit),
+    "venues": suggest_names(Venue, prefix, limit),
+  })
+
 
 #  Venues
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
 def venues():
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  data=[{
-    "city": "San Francisco",
-    "state": "CA",
-    "venues": [{
-      "id": 1,
-      "name": "The Musical Hop",
-      "num_upcoming_shows": 0,
-    }, {
-      "id": 3,
-      "name": "Park Square Live Music & Coffee",
-      "num_upcoming_shows": 1,
-    }]
-  }, {
-    "city": "New York",
-    "state": "NY",
-    "venues": [{
-      "id": 2,
-      "name": "The Dueling Pianos Bar",
-      "num_upcoming_shows": 0,
-    }]
-  }]
-  return render_template('pages/venues.html', areas=data);
+  return render_template('pages/venues.html', areas=venue_areas())
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for Hop should return "The Musical Hop".
-  # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  response={
-    "count": 1,
-    "data": [{
-      "id": 2,
-      "name": "The Dueling Pianos Bar",
-      "num_upcoming_shows": 0,
-    }]
-  }
+  response = search_by_name(Venue, Show.venue_id, request.form.get('search_term', ''))
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/venues/<int:venue_id>')
@@ -257,17 +376,7 @@ def artists():
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
-  # search for "band" should return "The Wild Sax Band".
-  response={
-    "count": 1,
-    "data": [{
-      "id": 4,
-      "name": "Guns N Petals",
-      "num_upcoming_shows": 0,
-    }]
-  }
+  response = search_by_name(Artist, Show.artist_id, request.form.get('search_term', ''))
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/artists/<int:artist_id>')
@@ -0,0 +1,165 @@
+import bisect
+import threading
+import time
+
+# characters per n-gram, as in postgres' pg_trgm
+NGRAM_SIZE = 3
+# suggestions returned by default and at most by a prefix search
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 50
+
+
+def ngrams(text):
+    return {text[i:i + NGRAM_SIZE]
+            for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class NameIndex:
+    """In-memory index of the names of one model, by id
+    Loaded from the database on first use and kept up to date through
+    add() and remove(). With a max_age it is also reloaded once older,
+    to pick up the changes made by other processes
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._clear()
+
+    @property
+    def expired(self):
+        if self.loaded_at is None:
+            return True
+        return self.max_age is not None and \
+            time.monotonic() - self.loaded_at >= self.max_age
+
+    def _load(self, rows):
+        for id, name in rows:
+            self._add(id, name or '')
+
+    def load(self, rows):
+        """Replaces the index with (id, name) rows"""
+        with self._lock:
+            self._clear()
+            self._load(rows)
+            self.loaded_at = time.monotonic()
+
+    def add(self, id, name):
+        with self._lock:
+            if self.loaded_at is not None:
+                self._remove(id)
+                self._add(id, name or '')
+
+    def remove(self, id):
+        with self._lock:
+            if self.loaded_at is not None:
+                self._remove(id)
+
+
+class NgramIndex(NameIndex):
+    """Case-insensitive substring search over names
+    Every lowercased name is indexed by its n-grams: the names containing a
+    term are among those holding all of the term's n-grams, so only they
+    are checked. Terms shorter than an n-gram fall back to a scan
+    """
+
+    def _clear(self):
+        self._names = {}
+        self._postings = {}
+
+    def _add(self, id, name):
+        name = name.lower()
+        self._names[id] = name
+        for ngram in ngrams(name):
+            self._postings.setdefault(ngram, set()).add(id)
+
+    def _remove(self, id):
+        name = self._names.pop(id, None)
+        if name is None:
+            return
+        for ngram in ngrams(name):
+            postings = self._postings[ngram]
+            postings.discard(id)
+            if not postings:
+                del self._postings[ngram]
+
+    def search(self, term):
+        """Returns the ids of the names containing term, in any case"""
+        term = term.lower()
+        with self._lock:
+            names = self._names
+            if len(term) < NGRAM_SIZE:
+                return [id for id, name in names.items() if term in name]
+
+            postings = sorted((self._postings.get(ngram, set())
+                               for ngram in ngrams(term)), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+            return [id for id in candidates if term in names[id]]
+
+
+def word_starts(name):
+    """Offsets of the words of name, so that any word can be a prefix"""
+    return [i for i, char in enumerate(name)
+            if not char.isspace() and (i == 0 or name[i - 1].isspace())]
+
+
+class PrefixIndex(NameIndex):
+    """Case-insensitive prefix search over names, for type-ahead
+    Every lowercased name is kept in a sorted list once per word, from that
+    word to its end, so "sax" finds "The Wild Sax Band". The entries
+    starting with a prefix are contiguous: bisect finds the first one and
+    a search only reads the entries it returns, and the other words of
+    the names already found
+    """
+
+    def _clear(self):
+        self._names = {}
+        self._keys = []
+
+    def _load(self, rows):
+        # sorted once, insort would shift the list for every entry
+        for id, name in rows:
+            name = name or ''
+            lowered = name.lower()
+            self._names[id] = name
+            self._keys.extend((lowered[start:], id)
+                              for start in word_starts(lowered))
+        self._keys.sort()
+
+    def _add(self, id, name):
+        lowered = name.lower()
+        self._names[id] = name
+        for start in word_starts(lowered):
+            bisect.insort(self._keys, (lowered[start:], id))
+
+    def _remove(self, id):
+        name = self._names.pop(id, None)
+        if name is None:
+            return
+        lowered = name.lower()
+        for start in word_starts(lowered):
+            key = (lowered[start:], id)
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+
+    def search(self, prefix, limit=SUGGEST_LIMIT):
+        """Returns up to limit (id, name) whose name or one of its words
+        starts with prefix, in any case, by matched text
+        """
+        prefix = prefix.lower().strip()
+        if not prefix or limit <= 0:
+            return []
+        with self._lock:
+            keys = self._keys
+            i = bisect.bisect_left(keys, (prefix,))
+            found = {}
+            while i < len(keys) and len(found) < limit:
+                key, id = keys[i]
+                if not key.startswith(prefix):
+                    break
+                if id not in found:
+                    found[id] = self._names[id]
+                i += 1
+            return list(found.items())
@@ -0,0 +1,17 @@
+--
+-- Case-insensitive substring search on artist and venue names
+-- Adds trigram GIN indexes on name, used by ILIKE '%term%'
+-- Apply to an existing database: psql fyyur < sql/0001_name_trigram_search.sql
+--
+
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS venue_name_trgm_idx
+    ON "Venue" USING GIN (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS artist_name_trgm_idx
+    ON "Artist" USING GIN (name gin_trgm_ops);
+
+COMMIT;
@@ -2,3 +2,30 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// type-ahead for the search boxes, from /search/suggest
+document.querySelectorAll('input[data-suggest]').forEach(function (input) {
+  var list = document.getElementById(input.getAttribute('list'));
+  var timer = null;
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      var q = input.value;
+      if (!q.trim()) {
+        list.innerHTML = '';
+        return;
+      }
+      fetch('/search/suggest?q=' + encodeURIComponent(q))
+        .then(function (response) { return response.json(); })
+        .then(function (suggestions) {
+          if (input.value !== q) return;
+          list.innerHTML = '';
+          suggestions[input.dataset.suggest].forEach(function (suggestion) {
+            var option = document.createElement('option');
+            option.value = suggestion.name;
+            list.appendChild(option);
+          });
+        });
+    }, 100);
+  });
+});
@@ -0,0 +1,264 @@
+"""Scaling benchmark for the trivia api
+
+Generates a synthetic question bank at every requested size, in a
+temporary sqlite database or in a local postgres database, and times the
+read endpoints against it: paging, search, per-category listing and
+quizzes. The first request of every endpoint is reported apart since it
+builds the in-memory indexes. The report gives the latency percentiles
+per size and the growth exponent of the median between sizes, close to 0
+for endpoints that do not depend on the size of the bank and close to 1
+for O(n) ones.
+
+EXAMPLE
+    python benchmark.py --sizes 10000 100000 1000000 \\
+        --output benchmark-results.json
+    python benchmark.py --database-url postgresql://localhost/trivia_bench
+
+The postgres database is emptied before each size.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from flaskr import create_app
+from flaskr.bulk import import_questions
+from models import db, Category
+
+SEARCH_MIGRATION = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'migrations', '0001_question_search.sql')
+
+SYLLABLES = ['ka', 'ri', 'to', 'me', 'sa', 'lo', 'ne', 'vu', 'pi', 'da',
+             'gor', 'zen', 'mil', 'tas', 'ber', 'qui', 'fal', 'wen']
+# growth exponent above which an endpoint is reported as O(n)
+LINEAR_EXPONENT = 0.7
+
+
+def vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES)
+                          for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+class QuestionBank:
+    """Synthetic questions whose words follow a zipf-like distribution,
+    so search terms range from very common to rare
+    """
+
+    def __init__(self, categories, seed=0, vocabulary_size=20000):
+        self.categories = categories
+        self.seed = seed
+        rng = random.Random(seed)
+        self.words = vocabulary(vocabulary_size, rng)
+        self.cum_weights = list(itertools.accumulate(
+            1 / (rank + 1) for rank in range(len(self.words))))
+
+    def rows(self, size):
+        """Yields size rows of flaskr.bulk.COLUMNS"""
+        rng = random.Random(self.seed)
+        for i in range(size):
+            words = rng.choices(self.words, cum_weights=self.cum_weights,
+                                k=rng.randint(6, 14))
+            yield (' '.join(words).capitalize() + '?',
+                   rng.choice(self.words),
+                   1 + i % self.categories,
+                   rng.randint(1, 5))
+
+    def term(self, rank):
+        return self.words[rank]
+
+
+def percentile(latencies, p):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = max(int(round(p / 100 * len(latencies) + 0.5)) - 1, 0)
+    return latencies[min(rank, len(latencies) - 1)]
+
+
+class Benchmark:
+    def __init__(self, bank, requests, database_url=None):
+        self.bank = bank
+        self.requests = requests
+        self.database_url = database_url
+
+    def setup(self, size):
+        if self.database_url is None:
+            fd, self.database_file = tempfile.mkstemp(suffix='.db')
+            os.close(fd)
+            database_url = 'sqlite:///' + self.database_file
+        else:
+            self.database_file = None
+            database_url = self.database_url
+
+        self.app = app = create_app(
+            {'SQLALCHEMY_DATABASE_URI': database_url})
+        self.client = app.test_client()
+        self.size = size
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            if db.engine.dialect.name == 'postgresql':
+                connection = db.engine.raw_connection()
+                try:
+                    with open(SEARCH_MIGRATION) as f:
+                        connection.cursor().execute(f.read())
+                    connection.commit()
+                finally:
+                    connection.close()
+            for i in range(self.bank.categories):
+                db.session.add(Category('Category {}'.format(i + 1)))
+            db.session.commit()
+
+            start = time.perf_counter()
+            import_questions(self.bank.rows(size))
+            self.import_seconds = time.perf_counter() - start
+
+    def teardown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+        if self.database_file is not None:
+            os.remove(self.database_file)
+
+    def routes(self):
+        """Yields (name, request) for every endpoint timed"""
+        client = self.client
+        last_page = max(self.size // 10, 1)
+        common, rare = self.bank.term(0), self.bank.term(
+            len(self.bank.words) // 2)
+        previous = list(range(1, 6))
+
+        yield 'GET /questions', lambda: client.get('/questions')
+        yield 'GET /questions (last page)', lambda: client.get(
+            '/questions?page={}'.format(last_page))
+        yield 'GET /questions (after_id)', lambda: client.get(
+            '/questions?after_id={}'.format(max(self.size - 10, 0)))
+        yield 'GET /categories/<id>/questions', lambda: client.get(
+            '/categories/0/questions')
+        yield 'POST /questions (search common)', lambda: client.post(
+            '/questions', json={'searchTerm': common})
+        yield 'POST /questions (search rare)', lambda: client.post(
+            '/questions', json={'searchTerm': rare})
+        yield 'POST /quizzes', lambda: client.post('/quizzes', json={
+            'quiz_category': {'type': 'Category 1', 'id': 0},
+            'previous_questions': previous})
+        yield 'POST /quizzes (all, difficulty)', lambda: client.post(
+            '/quizzes', json={
+                'quiz_category': {'type': 'click', 'id': 0},
+                'previous_questions': previous,
+                'difficulty': 4})
+
+    def timed(self, send):
+        start = time.perf_counter()
+        response = send()
+        return time.perf_counter() - start, response.status_code == 200
+
+    def run_route(self, send):
+        first, first_ok = self.timed(send)
+        results = [self.timed(send) for _ in range(self.requests)]
+        latencies = sorted(latency * 1000 for latency, _ in results)
+        return {
+            'requests': len(results),
+            'errors': sum(1 for _, ok in results if not ok) +
+            (0 if first_ok else 1),
+            'first_ms': first * 1000,
+            'mean_ms': statistics.mean(latencies),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99)
+        }
+
+    def run(self, size):
+        self.setup(size)
+        try:
+            routes = {name: self.run_route(send)
+                      for name, send in self.routes()}
+        finally:
+            self.teardown()
+        return {'import_seconds': self.import_seconds, 'routes': routes}
+
+
+def growth(sizes, results, key):
+    """Growth exponents of key between consecutive sizes, for each route
+    t ~ n ** exponent, computed on the log-log slope
+    """
+    exponents = {}
+    for small, large in zip(sizes, sizes[1:]):
+        for name, route in results[large]['routes'].items():
+            before = results[small]['routes'][name][key]
+            after = route[key]
+            exponent = math.log(max(after, 1e-6) / max(before, 1e-6)) / \
+                math.log(large / small)
+            exponents.setdefault(name, []).append(exponent)
+    return exponents
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000],
+                        help='numbers of questions, e.g. 10000 100000 '
+                             '1000000')
+    parser.add_argument('--categories', type=int, default=6)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests sent to each endpoint at each size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url', default=None,
+                        help='postgres database to fill, emptied first; '
+                             'a temporary sqlite database by default')
+    parser.add_argument('--output', default='benchmark-results.json')
+    args = parser.parse_args()
+
+    sizes = sorted(set(args.sizes))
+    bank = QuestionBank(args.categories, args.seed)
+    benchmark = Benchmark(bank, args.requests, args.database_url)
+
+    results = {}
+    for size in sizes:
+        results[size] = benchmark.run(size)
+        print('{} questions imported in {:.1f}s'.format(
+            size, results[size]['import_seconds']))
+        for name, route in results[size]['routes'].items():
+            print('  {:<34} first {:8.2f}ms  p50 {:7.2f}ms  p95 {:7.2f}ms  '
+                  '{} errors'.format(name, route['first_ms'],
+                                     route['p50_ms'], route['p95_ms'],
+                                     route['errors']))
+
+    exponents = growth(sizes, results, 'p50_ms')
+    first_exponents = growth(sizes, results, 'first_ms')
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'settings': vars(args),
+        'sizes': {str(size): result for size, result in results.items()},
+        'growth': {
+            name: {
+                'p50_exponents': exponents[name],
+                'first_exponents': first_exponents[name],
+                'linear': max(exponents[name]) >= LINEAR_EXPONENT
+            } for name in exponents}
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if exponents:
+        print('growth of the median latency, t ~ n ** exponent:')
+        for name, values in exponents.items():
+            print('  {:<34} {}{}'.format(
+                name, '  '.join('{:5.2f}'.format(v) for v in values),
+                '  O(n)' if max(values) >= LINEAR_EXPONENT else ''))
+    print('results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
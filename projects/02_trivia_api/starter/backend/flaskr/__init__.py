@@ -1,35 +1,123 @@
 import os
-from flask import Flask, request, abort, jsonify
+import json
+import math
+import click
+from flask import Flask, request, abort, jsonify, Response, \
+    stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import random
-from sqlalchemy import func
 
-from models import setup_db, Question, Category
+from models import setup_db, Question
+from .bulk import FORMATS, BulkImportError, export_questions, \
+    import_questions, read_rows
+from .catalog import CategoryCatalog
+from .duplicates import DuplicateIndex
+from .quiz_index import QuizIndex
+from .quiz_sessions import QuizSessionStore
+from .search import QuestionSearch
+from .weighted import DEFAULT_SPREAD, MAX_DIFFICULTY, MIN_DIFFICULTY, \
+    MIN_SPREAD
 
 QUESTIONS_PER_PAGE = 10
+# what POST /questions does with near-duplicates of the new question
+DUPLICATE_MODES = ('flag', 'reject', 'ignore')
 
 
-# Using similar pagination implementation as code for bookshelf api in
-# Udacity course
-def paginate_questions(request, selection):
+def page_offset(request):
+    """Returns the offset of the requested page, None if out of range"""
     page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
+    if page < 1:
+        return None
+    return (page - 1) * QUESTIONS_PER_PAGE
+
+
+# Using similar pagination implementation as code for bookshelf api in
+# Udacity course, with the slicing pushed into the database: only the rows
+# of the requested page are loaded. Deep pages can use keyset pagination
+# with ?after_id=<last id of the previous page> instead of ?page=
+def paginate_questions(request, query):
+    after_id = request.args.get('after_id', None, type=int)
+    if after_id is not None:
+        query = query.filter(Question.id > after_id)
+        offset = 0
+    else:
+        offset = page_offset(request)
+        if offset is None:
+            return []
 
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
+    selection = query.order_by(Question.id).offset(
+        offset).limit(QUESTIONS_PER_PAGE)
 
-    return current_questions
+    return [question.format() for question in selection]
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    if app.config.get('SQLALCHEMY_DATABASE_URI'):
+        setup_db(app, app.config['SQLALCHEMY_DATABASE_URI'])
+    else:
+        setup_db(app)
 
     CORS(app, resources={r"/*": {"origins": "*"}})
 
+    # category names and question counts shared by every endpoint, loaded
+    # on first use once the database binding is final (tests rebind it
+    # with setup_db after create_app)
+    catalog = CategoryCatalog()
+    # ids of the questions per category, used to draw quiz questions
+    quiz_index = QuizIndex()
+    # server-side quizzes, each plays a shuffled deck of its category
+    quiz_sessions = QuizSessionStore()
+    # ranked full-text search over questions and answers
+    question_search = QuestionSearch()
+    # minhash signatures of the questions, to spot near-duplicates
+    duplicate_index = DuplicateIndex()
+
+    # every in-memory index has to follow the writes made through the api
+    def question_added(question):
+        catalog.question_added(question.category)
+        quiz_index.add(question)
+        question_search.add(question)
+        duplicate_index.add(question)
+
+    def question_removed(question_id, category):
+        catalog.question_removed(category)
+        quiz_index.remove(question_id)
+        question_search.remove(question_id)
+        duplicate_index.remove(question_id)
+
+    def write_response(key, question_id, category, **fields):
+        # ?return=minimal (or a Prefer: return=minimal header) answers with
+        # counts from the catalog instead of reloading the first page
+        body = {
+            "success": True,
+            key: question_id,
+            'total_questions': catalog.count()
+        }
+        body.update(fields)
+        if request.args.get('return', None) == 'minimal' or \
+                'return=minimal' in request.headers.get('Prefer', ''):
+            body['category_questions'] = catalog.count(category)
+            return jsonify(body)
+
+        body.update({
+            'questions': paginate_questions(request, Question.query),
+            'current_category': catalog.current_category(),
+            'categories': catalog.categories()
+        })
+        return jsonify(body)
+
+    def questions_imported():
+        # imports bypass the per-question hooks, resync on next use
+        catalog.expire()
+        quiz_index.expire()
+        question_search.expire()
+        duplicate_index.expire()
+
     # CORS Headers
     @app.after_request
     def after_request(response):
@@ -43,36 +131,26 @@ def create_app(test_config=None):
 
     @app.route('/categories')
     def retrieve_categories():
-        categories = Category.query.order_by(Category.id).all()
+        categories = catalog.categories()
 
         if len(categories) == 0:
             abort(404)
 
-        return jsonify({'success': True, 'categories': [
-                       category.format()['type'] for category in categories]})
+        return jsonify({'success': True, 'categories': categories})
 
     @app.route('/questions')
     def get_questions():
-        questions = Question.query.order_by(Question.id).all()
-        current_category = [
-            category.format()["category"]
-            for category in Question.query.order_by(
-                Question.category).distinct(
-                Question.category)]
-        current_questions = paginate_questions(request, questions)
+        current_questions = paginate_questions(request, Question.query)
 
         if len(current_questions) == 0:
             abort(404)
 
-        categories = Category.query.order_by(Category.id).all()
-
         return jsonify({
             "success": True,
             'questions': current_questions,
-            'total_questions': len(questions),
-            'current_category': current_category,
-            'categories': [category.format()['type']
-                           for category in categories]
+            'total_questions': catalog.count(),
+            'current_category': catalog.current_category(),
+            'categories': catalog.categories()
         })
 
     @app.route('/questions/<int:question_id>', methods=['DELETE'])
@@ -84,24 +162,11 @@ def create_app(test_config=None):
             if question is None:
                 abort(404)
 
+            category = question.category
             question.delete()
-            selection = Question.query.order_by(Question.id).all()
-            current_questions = paginate_questions(request, selection)
-            current_category = [
-                category.format()["category"]
-                for category in Question.query.order_by(
-                    Question.category).distinct(
-                    Question.category)]
-            categories = Category.query.order_by(Category.id).all()
+            question_removed(question_id, category)
 
-            return jsonify({
-                "success": True,
-                'questions': current_questions,
-                'total_questions': len(selection),
-                'current_category': current_category,
-                'categories': [category.format()['type']
-                               for category in categories]
-            })
+            return write_response('deleted', question_id, category)
 
         except BaseException:
             abort(422)
@@ -116,79 +181,122 @@ def create_app(test_config=None):
         new_difficulty = body.get('difficulty', None)
         search_term = body.get('searchTerm', None)
 
+        duplicates_mode = request.args.get('duplicates', 'flag')
+        if duplicates_mode not in DUPLICATE_MODES:
+            abort(400)
+
         try:
             if search_term:
-                question_query = Question.query.filter(
-                    Question.question.ilike(f'%{search_term}%'))
-                questions = question_query.order_by(
-                    Question.id).all()
-
-                current_questions = paginate_questions(request, questions)
-                current_category = [
-                    category.format()["category"]
-                    for category in question_query.order_by(
-                        Question.category).distinct(
-                        Question.category)]
-                categories = Category.query.order_by(Category.id).all()
+                # results are paginated by relevance, not by id
+                offset = page_offset(request)
+                questions, total, categories = question_search.search(
+                    search_term, offset or 0, QUESTIONS_PER_PAGE)
+                if offset is None:
+                    questions = []
 
                 return jsonify({
                     "success": True,
-                    'questions': current_questions,
+                    'questions': [question.format()
+                                  for question in questions],
                     # assuming in this case we care about total questions for
                     # that search
-                    'total_questions': len(questions),
-                    'current_category': current_category,
-                    'categories': [category.format()['type']
-                                   for category in categories]
+                    'total_questions': total,
+                    'current_category': [category - 1
+                                         for category in categories],
+                    'categories': catalog.categories()
                 })
 
             else:
-                cat_id = str(int(new_category) + 1)
+                cat_id = int(new_category) + 1
+
+                duplicates = []
+                if duplicates_mode != 'ignore':
+                    duplicates = [
+                        {'id': question_id, 'similarity': score}
+                        for question_id, score
+                        in duplicate_index.find(new_question)]
+                if duplicates and duplicates_mode == 'reject':
+                    return jsonify({
+                        "success": False,
+                        "error": 409,
+                        "message": "duplicate question",
+                        'duplicates': duplicates
+                    }), 409
+
                 question = Question(
                     question=new_question,
                     answer=new_answer,
                     category=cat_id,
                     difficulty=new_difficulty)
                 question.insert()
+                question_added(question)
 
-                questions = Question.query.order_by(Question.id).all()
-                current_questions = paginate_questions(request, questions)
-                current_category = [
-                    category.format()["category"]
-                    for category in Question.query.order_by(
-                        Question.category).distinct(
-                        Question.category)]
-                categories = Category.query.order_by(Category.id).all()
+                if duplicates_mode == 'ignore':
+                    return write_response('created', question.id, cat_id)
+                return write_response('created', question.id, cat_id,
+                                      duplicates=duplicates)
 
-                return jsonify({
-                    "success": True,
-                    'questions': current_questions,
-                    'total_questions': len(questions),
-                    'current_category': current_category,
-                    'categories': [category.format()['type']
-                                   for category in categories]
-                })
+        except BaseException:
+            abort(422)
+
+    @app.route('/questions/import', methods=['POST'])
+    def import_question_bank():
+        fmt = request.args.get('format', None) or \
+            ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+        if fmt not in FORMATS:
+            abort(400)
 
+        # the body is read line by line, one chunk of rows at a time
+        try:
+            imported = import_questions(read_rows(request.stream, fmt))
+        except BulkImportError as error:
+            return jsonify({
+                "success": False,
+                "error": 422,
+                "message": str(error)
+            }), 422
         except BaseException:
             abort(422)
+        questions_imported()
+
+        return jsonify({
+            "success": True,
+            'imported': imported,
+            'total_questions': catalog.count()
+        })
+
+    @app.route('/questions/export')
+    def export_question_bank():
+        return Response(stream_with_context(export_questions()),
+                        mimetype='application/x-ndjson')
+
+    @app.route('/questions/duplicates')
+    def get_duplicate_questions():
+        threshold = request.args.get('threshold', None, type=float)
+        if threshold is not None and not 0 < threshold <= 1:
+            abort(400)
+
+        groups = duplicate_index.report(threshold)
+
+        return jsonify({
+            "success": True,
+            'groups': groups,
+            'total_groups': len(groups)
+        })
 
     @app.route('/categories/<int:category_id>/questions')
     def retrieve_questions_in_category(category_id):
         cat_id = category_id + 1
         questions = Question.query.filter(
-            Question.category == cat_id
-        ).order_by(
-            Question.id).all()
+            Question.category == cat_id)
         current_questions = paginate_questions(request, questions)
-        categories = Category.query.order_by(Category.id).all()
 
         return jsonify({
             "success": True,
             'questions': current_questions,
-            'total_questions': len(questions),
+            'total_questions': catalog.count(cat_id),
             'current_category': [category_id],
-            'categories': [category.format()['type']
-                           for category in categories]
+            'categories': catalog.categories()
         })
 
     @app.route('/quizzes', methods=['POST'])
@@ -200,18 +308,74 @@ def create_app(test_config=None):
         category_type = body.get('quiz_category', None)["type"]
         cat_id = category_id + 1
 
+        difficulty = body.get('difficulty', None)
+        spread = body.get('spread', DEFAULT_SPREAD)
+        for value in (difficulty, spread):
+            if value is not None and (not isinstance(value, (int, float))
+                                      or isinstance(value, bool)):
+                abort(400)
+        if spread is None or not MIN_SPREAD <= spread < math.inf:
+            abort(400)
+        if difficulty is not None and \
+                not MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY:
+            abort(400)
+
         if category_type == 'click':
-            category_questions = Question.query.order_by(func.random())
+            next_question = quiz_index.next_question(
+                exclude=previous_questions, difficulty=difficulty,
+                spread=spread)
         else:
-            category_questions = Question.query.filter(
-                Question.category == cat_id
-            ).order_by(
-                func.random())
+            next_question = quiz_index.next_question(
+                cat_id, exclude=previous_questions, difficulty=difficulty,
+                spread=spread)
 
-        previous_question_ids = [q for q in previous_questions]
+        if next_question is None:
+            return jsonify({
+                "success": True,
+                'question': None
+            })
+        else:
+            return jsonify({
+                "success": True,
+                'question': next_question.format()
+            })
 
-        next_question = category_questions.filter(
-            Question.id.notin_(previous_question_ids)).first()
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def start_quiz_session():
+        body = request.get_json()
+
+        quiz_category = body.get('quiz_category', None)
+        if quiz_category is None:
+            abort(400)
+
+        seed = body.get('seed', None)
+        if seed is not None and (
+                not isinstance(seed, int) or isinstance(seed, bool)):
+            abort(400)
+
+        if quiz_category["type"] == 'click':
+            cat_id = None
+        else:
+            cat_id = int(quiz_category["id"]) + 1
+        deck = quiz_index.deck(cat_id, seed)
+        session = quiz_sessions.create(cat_id, deck)
+
+        return jsonify({
+            "success": True,
+            'session_id': session.id,
+            'seed': deck.seed,
+            'deck_version': deck.version,
+            'total_questions': len(deck)
+        })
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def get_next_session_question(session_id):
+        session = quiz_sessions.get(session_id)
+        if session is None:
+            abort(404)
+
+        with session.lock:
+            next_question = session.deck.next_question()
 
         if next_question is None:
             return jsonify({
@@ -224,6 +388,38 @@ def create_app(test_config=None):
                 'question': next_question.format()
             })
 
+    @app.cli.command('import-questions')
+    @click.argument('source', type=click.File('rb'))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS),
+                  help='defaults to csv for .csv files, ndjson otherwise')
+    def import_questions_command(source, fmt):
+        """Imports questions from an ndjson or csv file, - for stdin"""
+        if fmt is None:
+            fmt = 'csv' if source.name.endswith('.csv') else 'ndjson'
+        try:
+            imported = import_questions(read_rows(source, fmt))
+        except BulkImportError as error:
+            raise click.ClickException(str(error))
+        click.echo('imported {} questions'.format(imported))
+
+    @app.cli.command('export-questions')
+    @click.argument('target', type=click.File('w'), default='-')
+    def export_questions_command(target):
+        """Exports every question as ndjson to a file, stdout by default"""
+        target.writelines(export_questions())
+
+    @app.cli.command('dedupe-report')
+    @click.option('--threshold', type=click.FloatRange(0, 1),
+                  help='estimated similarity of duplicates, 0.7 by default')
+    def dedupe_report_command(threshold):
+        """Prints the groups of near-duplicate questions, one per line"""
+        for group in duplicate_index.report(threshold):
+            questions = Question.query.filter(
+                Question.id.in_(group)).order_by(Question.id)
+            click.echo(json.dumps(
+                [{'id': question.id, 'question': question.question}
+                 for question in questions]))
+
     @app.errorhandler(404)
     def not_found(error):
         return jsonify({
@@ -0,0 +1,147 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from models import db, Question, Category
+from .weighted import MAX_DIFFICULTY, MIN_DIFFICULTY
+
+# rows sent to the database per COPY or executemany
+IMPORT_CHUNK_SIZE = 5000
+# rows fetched per round trip by the export cursor
+EXPORT_CHUNK_SIZE = 1000
+
+FORMATS = ('ndjson', 'csv')
+COLUMNS = ('question', 'answer', 'category', 'difficulty')
+
+
+class BulkImportError(ValueError):
+    """Raised for a row that cannot be imported, line is 1-based"""
+
+    def __init__(self, line, message):
+        super().__init__('line {}: {}'.format(line, message))
+        self.line = line
+
+
+def read_ndjson(lines):
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            yield None
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield 'invalid json'
+
+
+def read_csv(lines):
+    """Reads csv with a header row naming the columns"""
+    lines = (line.decode('utf-8') if isinstance(line, bytes) else line
+             for line in lines)
+    yield None
+    for row in csv.DictReader(lines):
+        yield row
+
+
+def validate_row(row, categories):
+    """Returns the row as a tuple of COLUMNS, with the database category
+    Categories use the api ids, as in the export and the other endpoints,
+    and must be among the database ids in categories
+    """
+    if not isinstance(row, dict):
+        raise ValueError(row if isinstance(row, str) else 'not an object')
+    try:
+        question = row['question']
+        answer = row['answer']
+        category = int(row['category']) + 1
+        difficulty = int(row['difficulty'])
+    except KeyError as error:
+        raise ValueError('missing {}'.format(error.args[0]))
+    except (TypeError, ValueError):
+        raise ValueError('category and difficulty must be integers')
+    if not isinstance(question, str) or not question.strip() or \
+            not isinstance(answer, str) or not answer.strip():
+        raise ValueError('question and answer must be non empty strings')
+    if category not in categories:
+        raise ValueError('unknown category {}'.format(category - 1))
+    if not MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY:
+        raise ValueError('difficulty must be between {} and {}'.format(
+            MIN_DIFFICULTY, MAX_DIFFICULTY))
+    return question, answer, category, difficulty
+
+
+def read_rows(lines, fmt):
+    """Yields the validated rows of an ndjson or csv stream
+    Raises BulkImportError on the first invalid row
+    """
+    categories = {category_id for category_id,
+                  in db.session.query(Category.id)}
+    reader = read_ndjson if fmt == 'ndjson' else read_csv
+    for number, row in enumerate(reader(lines), 1):
+        if row is None:
+            continue
+        try:
+            yield validate_row(row, categories)
+        except ValueError as error:
+            raise BulkImportError(number, str(error))
+
+
+def _copy_chunk(cursor, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        'COPY questions ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            ', '.join(COLUMNS)), buffer)
+
+
+def import_questions(rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """Inserts rows of COLUMNS in chunks, in a single transaction
+    Uses COPY on postgresql and executemany elsewhere, only one chunk is
+    held in memory. Returns the number of rows inserted
+    """
+    rows = iter(rows)
+    connection = db.session.connection()
+    copy = connection.dialect.name == 'postgresql'
+    cursor = connection.connection.cursor() if copy else None
+    insert = Question.__table__.insert()
+    count = 0
+    try:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            if copy:
+                _copy_chunk(cursor, chunk)
+            else:
+                connection.execute(
+                    insert, [dict(zip(COLUMNS, row)) for row in chunk])
+            count += len(chunk)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        if cursor is not None:
+            cursor.close()
+    return count
+
+
+def export_questions(chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields every question as an ndjson line, by id
+    Rows are streamed from a server-side cursor on postgresql
+    """
+    rows = db.session.query(
+        Question.id, Question.question, Question.answer,
+        Question.category, Question.difficulty).order_by(
+        Question.id).yield_per(chunk_size)
+    for question_id, question, answer, category, difficulty in rows:
+        yield json.dumps({
+            'id': question_id,
+            'question': question,
+            'answer': answer,
+            'category': category - 1,
+            'difficulty': difficulty
+        }) + '\n'
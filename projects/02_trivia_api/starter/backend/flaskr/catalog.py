@@ -0,0 +1,77 @@
+import threading
+import time
+from sqlalchemy import func
+
+from models import db, Question, Category
+
+# seconds before the catalog is reloaded to pick up changes made by other
+# processes, changes made through this app are applied right away
+CATALOG_MAX_AGE = 30
+
+
+'''
+CategoryCatalog
+process-level cache of the category names and of the number of questions
+in each category, shared by every endpoint
+category keys are the database ids, the api exposes them minus one
+'''
+
+
+class CategoryCatalog:
+    def __init__(self, max_age=CATALOG_MAX_AGE):
+        self.max_age = max_age
+        self._types = []
+        self._counts = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        types = [category.type for category in
+                 Category.query.order_by(Category.id)]
+        counts = dict(db.session.query(
+            Question.category, func.count(Question.id)).group_by(
+            Question.category))
+        with self._lock:
+            self._types = types
+            self._counts = {int(category): count
+                            for category, count in counts.items()}
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or \
+                time.monotonic() - self._loaded_at >= self.max_age:
+            self.load()
+
+    def expire(self):
+        """Makes the next use reload, e.g. after a bulk import"""
+        self._loaded_at = None
+
+    def categories(self):
+        """Returns the category names ordered by id"""
+        self._ensure_loaded()
+        return list(self._types)
+
+    def current_category(self):
+        """Returns the api ids of the categories that have questions"""
+        self._ensure_loaded()
+        with self._lock:
+            return sorted(category - 1 for category, count
+                          in self._counts.items() if count > 0)
+
+    def count(self, category=None):
+        """Returns the number of questions in category, or in total"""
+        self._ensure_loaded()
+        with self._lock:
+            if category is None:
+                return sum(self._counts.values())
+            return self._counts.get(int(category), 0)
+
+    def question_added(self, category):
+        with self._lock:
+            category = int(category)
+            self._counts[category] = self._counts.get(category, 0) + 1
+
+    def question_removed(self, category):
+        with self._lock:
+            category = int(category)
+            self._counts[category] = max(self._counts.get(category, 0) - 1, 0)
@@ -0,0 +1,178 @@
+import zlib
+from array import array
+
+from models import Question
+from .search import tokenize
+from .synced import SYNC_INTERVAL, SyncedIndex
+
+# estimated jaccard similarity above which two questions are duplicates
+DUPLICATE_THRESHOLD = 0.7
+
+# characters per shingle of the normalized question text
+SHINGLE_SIZE = 4
+# minhash values per signature, the first BANDS * ROWS are split in bands:
+# two questions become candidates when a band matches, likely from a
+# jaccard similarity of about (1 / BANDS) ** (1 / ROWS) = 0.6 on
+SIGNATURE_SIZE = 64
+BANDS = 12
+ROWS = 5
+
+BIN_BITS = SIGNATURE_SIZE.bit_length() - 1
+MAX_HASH = (1 << 32) - 1
+MASK_64 = (1 << 64) - 1
+# odd constants of fibonacci hashing, mix the shingle hashes and offset the
+# values borrowed by empty bins
+GOLDEN_64 = 0x9E3779B97F4A7C15
+GOLDEN_32 = 0x9E3779B1
+
+
+def shingles(text):
+    text = ' '.join(tokenize(text))
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE]
+            for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def signature(text):
+    """Returns the minhash signature of text, None when it has no words
+    One permutation hashing: every shingle is hashed once, the top bits
+    pick one of SIGNATURE_SIZE bins and each bin keeps its minimum. Empty
+    bins borrow the value of the next filled bin, offset by the distance
+    """
+    bins = [None] * SIGNATURE_SIZE
+    for shingle in shingles(text):
+        value = (zlib.crc32(shingle.encode('utf-8')) + 1) * GOLDEN_64 \
+            & MASK_64
+        i = value >> (64 - BIN_BITS)
+        value &= MAX_HASH
+        if bins[i] is None or value < bins[i]:
+            bins[i] = value
+    if all(value is None for value in bins):
+        return None
+
+    sig = array('I')
+    for i in range(SIGNATURE_SIZE):
+        distance = 0
+        while bins[(i + distance) % SIGNATURE_SIZE] is None:
+            distance += 1
+        sig.append((bins[(i + distance) % SIGNATURE_SIZE] +
+                    distance * GOLDEN_32) & MAX_HASH)
+    return sig
+
+
+def similarity(first, second):
+    """Estimates the jaccard similarity of two signatures"""
+    return sum(x == y for x, y in zip(first, second)) / SIGNATURE_SIZE
+
+
+def band_keys(sig):
+    return [hash(sig[i * ROWS:(i + 1) * ROWS].tobytes())
+            for i in range(BANDS)]
+
+
+'''
+DuplicateIndex
+locality sensitive hashing index of the minhash signatures of the
+question texts: similar questions share at least one band bucket, so only
+the questions of the matching buckets are compared, never the whole bank
+a bucket holding a single question stores its id rather than a list
+'''
+
+
+class DuplicateIndex(SyncedIndex):
+    columns = (Question.id, Question.question)
+
+    def __init__(self, threshold=DUPLICATE_THRESHOLD,
+                 sync_interval=SYNC_INTERVAL):
+        super().__init__(sync_interval)
+        self.threshold = threshold
+        self._signatures = {}
+        self._bands = [{} for _ in range(BANDS)]
+
+    def _add(self, question_id, text):
+        sig = signature(text)
+        if sig is None:
+            return
+        self._signatures[question_id] = sig
+        for band, key in zip(self._bands, band_keys(sig)):
+            bucket = band.get(key)
+            if bucket is None:
+                band[key] = question_id
+            elif isinstance(bucket, int):
+                band[key] = [bucket, question_id]
+            else:
+                bucket.append(question_id)
+
+    def _remove(self, question_id):
+        sig = self._signatures.pop(question_id, None)
+        if sig is None:
+            return
+        for band, key in zip(self._bands, band_keys(sig)):
+            bucket = band[key]
+            if isinstance(bucket, int):
+                del band[key]
+                continue
+            bucket.remove(question_id)
+            if len(bucket) == 1:
+                band[key] = bucket[0]
+
+    def _candidates(self, sig):
+        candidates = set()
+        for band, key in zip(self._bands, band_keys(sig)):
+            bucket = band.get(key)
+            if isinstance(bucket, int):
+                candidates.add(bucket)
+            elif bucket is not None:
+                candidates.update(bucket)
+        return candidates
+
+    def find(self, text, threshold=None):
+        """Returns (id, similarity) of the questions similar to text
+        Most similar first
+        """
+        threshold = self.threshold if threshold is None else threshold
+        sig = signature(text)
+        if sig is None:
+            return []
+        self.sync()
+        with self._lock:
+            matches = []
+            for question_id in self._candidates(sig):
+                score = similarity(sig, self._signatures[question_id])
+                if score >= threshold:
+                    matches.append((question_id, score))
+        return sorted(matches, key=lambda match: (-match[1], match[0]))
+
+    def report(self, threshold=None):
+        """Groups the whole bank into sets of similar questions
+        Every question is only compared to the questions sharing one of
+        its buckets, the groups are the connected components of the
+        similar pairs, as sorted id lists
+        """
+        threshold = self.threshold if threshold is None else threshold
+        self.sync()
+        parents = {}
+
+        def find_root(question_id):
+            root = question_id
+            while parents.get(root, root) != root:
+                root = parents[root]
+            while question_id != root:
+                parents[question_id], question_id = \
+                    root, parents[question_id]
+            return root
+
+        with self._lock:
+            signatures = self._signatures
+            for question_id, sig in signatures.items():
+                for other in self._candidates(sig):
+                    if other > question_id and similarity(
+                            sig, signatures[other]) >= threshold:
+                        parents[find_root(question_id)] = find_root(other)
+
+        groups = {}
+        for question_id in set(parents) | set(parents.values()):
+            groups.setdefault(find_root(question_id), []).append(
+                question_id)
+        return sorted(sorted(group) for group in groups.values())
@@ -0,0 +1,97 @@
+import hashlib
+import secrets
+
+from models import Question
+
+# rounds of the Feistel network behind a Permutation
+FEISTEL_ROUNDS = 4
+
+
+def new_seed():
+    return secrets.randbits(32)
+
+
+'''
+Permutation
+seeded pseudo-random permutation of range(size) computed on demand
+a balanced Feistel network over the smallest even power of two covering
+size, values falling outside range(size) are walked through it again
+the same seed and size always give the same order and nothing is stored
+per position, so a deck costs the same memory whatever its size
+'''
+
+
+class Permutation:
+    def __init__(self, size, seed):
+        self.size = size
+        bits = max((size - 1).bit_length(), 2)
+        self._half = (bits + 1) // 2
+        self._mask = (1 << self._half) - 1
+        self._keys = [
+            hashlib.blake2b(
+                '{}:{}'.format(seed, r).encode(), digest_size=16).digest()
+            for r in range(FEISTEL_ROUNDS)]
+
+    def _round(self, key, value):
+        digest = hashlib.blake2b(
+            value.to_bytes(8, 'big'), key=key, digest_size=8).digest()
+        return int.from_bytes(digest, 'big') & self._mask
+
+    def _encrypt(self, value):
+        left, right = value >> self._half, value & self._mask
+        for key in self._keys:
+            left, right = right, left ^ self._round(key, right)
+        return left << self._half | right
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.size:
+            raise IndexError(position)
+        value = self._encrypt(position)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+    def __len__(self):
+        return self.size
+
+
+'''
+Deck
+shuffled order of the questions of a category for one quiz
+ids is the sorted snapshot of the category taken from the QuizIndex when
+the quiz starts, shared by every deck built on the same snapshot, and
+version its fingerprint: the same seed on the same version replays the
+same quiz, in any process
+'''
+
+
+class Deck:
+    def __init__(self, ids, version, seed):
+        self.ids = ids
+        self.version = version
+        self.seed = seed
+        self.position = 0
+        self._order = Permutation(len(ids), seed)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def next_id(self):
+        """Returns the next question id of the deck, None at the end"""
+        if self.position >= len(self.ids):
+            return None
+        question_id = self.ids[self._order[self.position]]
+        self.position += 1
+        return question_id
+
+    def next_question(self):
+        """Returns the next question of the deck, or None at the end
+        Questions deleted since the quiz started are skipped
+        """
+        while True:
+            question_id = self.next_id()
+            if question_id is None:
+                return None
+            question = Question.query.get(question_id)
+            if question is not None:
+                return question
@@ -0,0 +1,200 @@
+import random
+import zlib
+from array import array
+
+from models import Question
+from .quiz_deck import Deck, new_seed
+from .synced import SYNC_INTERVAL, SyncedIndex
+from .weighted import AliasTable, DEFAULT_SPREAD, difficulty_weight
+
+# random draws tried before falling back to a scan of the category
+MAX_DRAWS = 16
+# alias tables kept per category, one per (target, spread) asked for
+MAX_ALIAS_TABLES = 32
+
+
+'''
+QuizIndex
+in-memory index of question ids per category used to draw quiz questions
+ids are kept in compact arrays; deleted ids are only marked as removed and
+skipped when drawn, the arrays are compacted once removals pile up
+version changes with every add or remove and keys the sorted snapshots
+quiz decks are built from
+ids are also grouped by difficulty for weighted draws: an alias table over
+the difficulty levels of a category picks a level, then an id is drawn
+uniformly in it. Tables are cached per target and spread and only the
+tables of a category that got new questions are rebuilt
+'''
+
+
+class QuizIndex(SyncedIndex):
+    columns = (Question.id, Question.category, Question.difficulty)
+
+    def __init__(self, sync_interval=SYNC_INTERVAL):
+        super().__init__(sync_interval)
+        self._all = array('q')
+        self._categories = {}
+        self._levels = {}
+        self._alias_tables = {}
+        self._removed = set()
+        self._snapshots = {}
+        self.version = 0
+
+    def _add(self, question_id, category, difficulty):
+        if question_id in self._removed:
+            # a reused id, its old entries may sit in other categories
+            self._compact()
+        category = int(category)
+        self._all.append(question_id)
+        self._categories.setdefault(category, array('q')).append(question_id)
+        if difficulty is not None:
+            for key in (category, None):
+                self._levels.setdefault(key, {}).setdefault(
+                    difficulty, array('q')).append(question_id)
+                self._alias_tables.pop(key, None)
+        self.version += 1
+
+    def _remove(self, question_id):
+        self._removed.add(question_id)
+        self.version += 1
+        if len(self._removed) > len(self._all) // 2:
+            self._compact()
+
+    def _compact(self):
+        removed = self._removed
+        self._all = array('q', (i for i in self._all if i not in removed))
+        self._categories = {
+            category: array('q', (i for i in ids if i not in removed))
+            for category, ids in self._categories.items()}
+        self._levels = {
+            category: {
+                difficulty: array('q', (i for i in ids if i not in removed))
+                for difficulty, ids in levels.items()}
+            for category, levels in self._levels.items()}
+        self._alias_tables = {}
+        self._removed = set()
+
+    def sample(self, category=None, exclude=()):
+        """Draws a question id uniformly among those not in exclude
+        category is the database category id, None means all categories
+        Returns None when every question was already served
+        """
+        with self._lock:
+            ids = self._all if category is None else \
+                self._categories.get(category, ())
+            removed = self._removed
+            if not ids:
+                return None
+
+            for _ in range(MAX_DRAWS):
+                question_id = ids[random.randrange(len(ids))]
+                if question_id not in exclude and question_id not in removed:
+                    return question_id
+
+            # most of the category was served, pick among what is left
+            candidates = [i for i in ids
+                          if i not in exclude and i not in removed]
+            return random.choice(candidates) if candidates else None
+
+    def _alias_table(self, category, target, spread):
+        key = (target, spread)
+        tables = self._alias_tables.setdefault(category, {})
+        if key not in tables:
+            levels = [(difficulty, ids) for difficulty, ids
+                      in self._levels.get(category, {}).items() if ids]
+            if not levels:
+                return None
+            weights = [difficulty_weight(difficulty, target, spread) * len(ids)
+                       for difficulty, ids in levels]
+            if not sum(weights):
+                # every level is too far from target, draw uniformly
+                weights = [len(ids) for _, ids in levels]
+            if len(tables) >= MAX_ALIAS_TABLES:
+                tables.clear()
+            tables[key] = ([ids for _, ids in levels], AliasTable(weights))
+        return tables[key]
+
+    def sample_weighted(self, category=None, exclude=(), target=None,
+                        spread=DEFAULT_SPREAD):
+        """Draws a question id not in exclude, leaning toward target
+        Each question weighs difficulty_weight(difficulty, target, spread),
+        questions without a difficulty are never drawn
+        Returns None when every question was already served
+        """
+        target, spread = round(float(target), 1), round(float(spread), 1)
+        with self._lock:
+            table = self._alias_table(category, target, spread)
+            if table is None:
+                return None
+            levels, alias = table
+            removed = self._removed
+
+            for _ in range(MAX_DRAWS):
+                ids = levels[alias.draw()]
+                question_id = ids[random.randrange(len(ids))]
+                if question_id not in exclude and question_id not in removed:
+                    return question_id
+
+            # most of the category was served, pick among what is left
+            candidates, weights = [], []
+            for difficulty, ids in self._levels.get(category, {}).items():
+                weight = difficulty_weight(difficulty, target, spread)
+                for question_id in ids:
+                    if question_id not in exclude and \
+                            question_id not in removed:
+                        candidates.append(question_id)
+                        weights.append(weight)
+            if not candidates:
+                return None
+            if not sum(weights):
+                return random.choice(candidates)
+            return random.choices(candidates, weights)[0]
+
+    def next_question(self, category=None, exclude=(), difficulty=None,
+                      spread=DEFAULT_SPREAD):
+        """Returns a random question not in exclude, or None
+        exclude can be any container of ids. With a target difficulty the
+        draw leans toward it, see sample_weighted(). Only the chosen row
+        is loaded from the database
+        """
+        self.sync()
+        if isinstance(exclude, (list, tuple)):
+            exclude = set(exclude)
+        while True:
+            if difficulty is None:
+                question_id = self.sample(category, exclude)
+            else:
+                question_id = self.sample_weighted(
+                    category, exclude, difficulty, spread)
+            if question_id is None:
+                return None
+            question = Question.query.get(question_id)
+            if question is not None:
+                return question
+            # deleted by another process
+            self.remove(question_id)
+
+    def snapshot(self, category=None):
+        """Returns the sorted ids of category and their fingerprint
+        The snapshot is cached until the index changes and must not be
+        modified, decks built on it share it
+        """
+        self.sync()
+        with self._lock:
+            cached = self._snapshots.get(category)
+            if cached is not None and cached[0] == self.version:
+                return cached[1:]
+            ids = self._all if category is None else \
+                self._categories.get(category, ())
+            removed = self._removed
+            ids = array('q', sorted(i for i in ids if i not in removed))
+            fingerprint = '{:08x}'.format(zlib.crc32(ids.tobytes()))
+            self._snapshots[category] = (self.version, ids, fingerprint)
+            return ids, fingerprint
+
+    def deck(self, category=None, seed=None):
+        """Shuffles the questions of category into a new Deck
+        A random seed is drawn when none is given
+        """
+        ids, fingerprint = self.snapshot(category)
+        return Deck(ids, fingerprint, new_seed() if seed is None else seed)
@@ -0,0 +1,68 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# maximum number of quiz sessions kept in memory
+QUIZ_SESSIONS_SIZE = 10000
+# seconds a quiz session lives after its last request
+QUIZ_SESSION_TTL = 3600
+
+'''
+QuizSession
+a quiz in progress: its category (database id, None for all categories)
+and the shuffled deck of its questions
+'''
+
+
+class QuizSession:
+    def __init__(self, category, deck):
+        self.id = secrets.token_urlsafe(16)
+        self.category = category
+        self.deck = deck
+        self.lock = threading.Lock()
+
+
+'''
+QuizSessionStore
+bounded store of quiz sessions, the least recently used session is
+evicted when full and idle sessions expire after ttl seconds
+'''
+
+
+class QuizSessionStore:
+    def __init__(self, maxsize=QUIZ_SESSIONS_SIZE, ttl=QUIZ_SESSION_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        while self._sessions:
+            session_id, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used < self.ttl and \
+                    len(self._sessions) <= self.maxsize:
+                break
+            del self._sessions[session_id]
+
+    def create(self, category, deck):
+        session = QuizSession(category, deck)
+        with self._lock:
+            now = time.monotonic()
+            self._sessions[session.id] = (session, now)
+            self._evict(now)
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            now = time.monotonic()
+            self._evict(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (entry[0], now)
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def __len__(self):
+        return len(self._sessions)
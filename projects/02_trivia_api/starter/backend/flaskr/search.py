@@ -0,0 +1,197 @@
+import bisect
+import heapq
+import math
+import re
+from collections import Counter
+from sqlalchemy import func, inspect, literal_column
+
+from models import db, Question
+from .synced import SYNC_INTERVAL, SyncedIndex
+
+# text search configuration used by migrations/0001_question_search.sql
+TEXT_SEARCH_CONFIG = 'english'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+'''
+PostgresSearch
+ranked full-text search on the search_vector column, kept up to date by
+the trigger and served by the GIN index of the migration
+every search term is matched as a prefix, so partial words still match
+'''
+
+
+class PostgresSearch:
+    def __init__(self):
+        self.vector = literal_column('questions.search_vector')
+
+    def search(self, term, offset, limit):
+        tokens = tokenize(term)
+        if not tokens:
+            return [], 0, []
+
+        tsquery = func.to_tsquery(
+            TEXT_SEARCH_CONFIG, ' & '.join(t + ':*' for t in tokens))
+        matches = Question.query.filter(self.vector.op('@@')(tsquery))
+
+        selection = matches.order_by(
+            func.ts_rank(self.vector, tsquery).desc(),
+            Question.id).offset(offset).limit(limit)
+        categories = [category for category, in matches.with_entities(
+            Question.category).distinct()]
+
+        return (selection.all(), matches.count(),
+                sorted(int(category) for category in categories))
+
+    # the trigger of the migration maintains the index
+    def add(self, question):
+        pass
+
+    def remove(self, question_id):
+        pass
+
+    def expire(self):
+        pass
+
+
+'''
+InvertedIndexSearch
+pure python fallback for databases without the search_vector column,
+e.g. sqlite in tests: an inverted index from token to question ids,
+ranked by tf-idf with prefix matching on a sorted vocabulary
+'''
+
+
+class InvertedIndexSearch(SyncedIndex):
+    columns = (Question.id, Question.question, Question.answer,
+               Question.category)
+
+    def __init__(self, sync_interval=SYNC_INTERVAL):
+        super().__init__(sync_interval)
+        self._postings = {}
+        self._documents = {}
+        self._vocabulary = None
+
+    def _add(self, question_id, question, answer, category):
+        tokens = Counter(tokenize(question) + tokenize(answer))
+        for token, count in tokens.items():
+            if token not in self._postings:
+                self._postings[token] = {}
+                self._vocabulary = None
+            self._postings[token][question_id] = count
+        self._documents[question_id] = (category, tuple(tokens))
+
+    def _remove(self, question_id):
+        document = self._documents.pop(question_id, None)
+        if document is None:
+            return
+        for token in document[1]:
+            postings = self._postings[token]
+            postings.pop(question_id, None)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary = None
+
+    def _expand(self, prefix):
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        for token in self._vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            yield token
+
+    def rank(self, term, limit):
+        """Returns the limit best (id, category) matching every token of
+        term, the number of matches and the categories of all of them
+        Only the best are sorted, the other matches are just counted
+        """
+        tokens = tokenize(term)
+        if not tokens:
+            return [], 0, set()
+
+        with self._lock:
+            total = len(self._documents) or 1
+            scores = None
+            for prefix in tokens:
+                token_scores = Counter()
+                for token in self._expand(prefix):
+                    postings = self._postings[token]
+                    idf = math.log(1 + total / len(postings))
+                    for question_id, count in postings.items():
+                        token_scores[question_id] += count * idf
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = Counter({
+                        question_id: score + token_scores[question_id]
+                        for question_id, score in scores.items()
+                        if question_id in token_scores})
+                if not scores:
+                    return [], 0, set()
+            documents = self._documents
+
+            best = heapq.nsmallest(limit, scores.items(),
+                                   key=lambda item: (-item[1], item[0]))
+            return ([(question_id, documents[question_id][0])
+                     for question_id, _ in best],
+                    len(scores),
+                    {documents[question_id][0] for question_id in scores})
+
+    def search(self, term, offset, limit):
+        self.sync()
+        ranked, total, categories = self.rank(term, offset + limit)
+        page_ids = [question_id for question_id, _
+                    in ranked[offset:offset + limit]]
+        rows = {question.id: question for question in
+                Question.query.filter(Question.id.in_(page_ids))}
+
+        return ([rows[question_id] for question_id in page_ids
+                 if question_id in rows],
+                total, sorted(int(category) for category in categories))
+
+
+'''
+QuestionSearch
+picks the search backend once the database is known: PostgresSearch when
+the search_vector column exists, InvertedIndexSearch otherwise
+search() returns the questions of the page, the total number of matches
+and the database ids of the categories they belong to
+'''
+
+
+class QuestionSearch:
+    def __init__(self):
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            columns = [column['name'] for column in
+                       inspect(db.engine).get_columns('questions')]
+            if db.engine.dialect.name == 'postgresql' and \
+                    'search_vector' in columns:
+                self._backend = PostgresSearch()
+            else:
+                self._backend = InvertedIndexSearch()
+        return self._backend
+
+    def search(self, term, offset, limit):
+        return self.backend.search(term, offset, limit)
+
+    def add(self, question):
+        if self._backend is not None:
+            self._backend.add(question)
+
+    def remove(self, question_id):
+        if self._backend is not None:
+            self._backend.remove(question_id)
+
+    def expire(self):
+        if self._backend is not None:
+            self._backend.expire()
@@ -0,0 +1,226 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import func, or_
+
+from models import db, Question, QuestionChange
+
+# seconds between checks for questions written by other processes
+SYNC_INTERVAL = 5
+# ids per query when loading the rows missing from an index
+SYNC_CHUNK_SIZE = 500
+# seconds a hole in the change log is waited for, a transaction still
+# running or one rolled back, before the next reconcile covers it
+GAP_TIMEOUT = 300
+# seconds between two reconciles of the ids with the table
+RECONCILE_INTERVAL = 3600
+# seconds the change log is kept, longer than RECONCILE_INTERVAL
+CHANGE_LOG_RETENTION = 24 * 3600
+
+
+'''
+SyncedIndex
+base of the in-memory indexes over the questions table
+the table is loaded on first use. Writes made through this process are
+applied right away with add() and remove(); sync() catches up with the
+other processes at most once per sync_interval. On the request thread it
+only reads the last id of the question_changes log, filled by triggers;
+the rows of the ids logged since are reloaded on a background thread, so
+an id deleted and reused in between is indexed with its new row
+log ids left out are waited for up to GAP_TIMEOUT as they may belong to
+a transaction still running. The background thread also reconciles the
+ids with the table once per RECONCILE_INTERVAL, or sooner when a hole
+was given up on, and prunes the log
+subclasses list the columns of their rows, the id first, index a row in
+_add() and drop an id in _remove()
+'''
+
+
+class SyncedIndex:
+    columns = (Question.id,)
+
+    def __init__(self, sync_interval=SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        # hash of the indexed row per id, rows logged but unchanged are
+        # not indexed again
+        self._rows = {}
+        self._change_id = 0
+        # holes (first id, last id, seen at) left in the change log
+        self._gaps = []
+        self._synced_at = None
+        self._reconciled_at = None
+        self._syncing = False
+        self._lock = threading.Lock()
+
+    def _add(self, question_id, *values):
+        raise NotImplementedError
+
+    def _remove(self, question_id):
+        raise NotImplementedError
+
+    def _index(self, row):
+        question_id, digest = row[0], hash(tuple(row))
+        if self._rows.get(question_id) == digest:
+            return
+        self._unindex(question_id)
+        self._rows[question_id] = digest
+        self._add(*row)
+
+    def _unindex(self, question_id):
+        if self._rows.pop(question_id, None) is not None:
+            self._remove(question_id)
+
+    def _missing_rows(self, table_ids, missing):
+        if len(missing) > len(table_ids) // 2:
+            # most of the table: one scan
+            return [row for row in db.session.query(*self.columns)
+                    if row[0] in missing]
+        missing = sorted(missing)
+        rows = []
+        for start in range(0, len(missing), SYNC_CHUNK_SIZE):
+            rows.extend(db.session.query(*self.columns).filter(
+                Question.id.in_(missing[start:start + SYNC_CHUNK_SIZE])))
+        return rows
+
+    def _last_change_id(self):
+        return db.session.query(func.max(QuestionChange.id)).scalar() or 0
+
+    def _load(self, now):
+        # the log is read first, changes made during the load are replayed
+        change_id = self._last_change_id()
+        rows = db.session.query(*self.columns).order_by(Question.id).all()
+        with self._lock:
+            for row in rows:
+                self._index(row)
+            self._change_id = max(self._change_id, change_id)
+            self._synced_at = self._reconciled_at = now
+
+    def _reload(self, question_ids):
+        question_ids = sorted(question_ids)
+        for start in range(0, len(question_ids), SYNC_CHUNK_SIZE):
+            chunk = question_ids[start:start + SYNC_CHUNK_SIZE]
+            rows = db.session.query(*self.columns).filter(
+                Question.id.in_(chunk)).all()
+            with self._lock:
+                for question_id in set(chunk) - {row[0] for row in rows}:
+                    self._unindex(question_id)
+                for row in rows:
+                    self._index(row)
+
+    def _advance(self, change_ids, now):
+        # change_ids are sorted and all lie past _change_id or in a gap
+        ranges = self._gaps
+        if change_ids and change_ids[-1] > self._change_id:
+            ranges = ranges + [(self._change_id + 1, change_ids[-1], now)]
+            self._change_id = change_ids[-1]
+        gaps = []
+        for first, last, seen_at in ranges:
+            found = change_ids[bisect_left(change_ids, first):
+                               bisect_right(change_ids, last)]
+            for change_id in found:
+                if change_id > first:
+                    gaps.append((first, change_id - 1, seen_at))
+                first = change_id + 1
+            if first <= last:
+                gaps.append((first, last, seen_at))
+        self._gaps = [gap for gap in gaps if now - gap[2] < GAP_TIMEOUT]
+        if len(self._gaps) < len(gaps):
+            self._reconciled_at = None
+
+    def _apply_changes(self):
+        with self._lock:
+            change_id, gaps = self._change_id, list(self._gaps)
+        changes = db.session.query(
+            QuestionChange.id, QuestionChange.question_id).filter(or_(
+                QuestionChange.id > change_id,
+                *[QuestionChange.id.between(first, last)
+                  for first, last, _ in gaps])).order_by(
+            QuestionChange.id).all()
+        self._reload({question_id for _, question_id in changes})
+        with self._lock:
+            self._advance([change_id for change_id, _ in changes],
+                          time.monotonic())
+
+    def _reconcile(self, now):
+        table_ids = {question_id for question_id,
+                     in db.session.query(Question.id)}
+        with self._lock:
+            missing = table_ids - self._rows.keys()
+            deleted = self._rows.keys() - table_ids
+        rows = self._missing_rows(table_ids, missing)
+        with self._lock:
+            # an id added meanwhile by this process can be dropped here,
+            # _apply_changes() loads it back from its log entry
+            for question_id in deleted:
+                self._unindex(question_id)
+            for row in sorted(rows):
+                self._index(row)
+            self._reconciled_at = now
+
+        cutoff = datetime.now(timezone.utc) - \
+            timedelta(seconds=CHANGE_LOG_RETENTION)
+        QuestionChange.query.filter(
+            QuestionChange.changed_at < cutoff).delete(
+            synchronize_session=False)
+        db.session.commit()
+
+    def _catch_up(self, app, reconcile):
+        try:
+            with app.app_context():
+                if reconcile:
+                    self._reconcile(time.monotonic())
+                self._apply_changes()
+        finally:
+            with self._lock:
+                self._syncing = False
+
+    def sync(self):
+        """Applies the writes of other processes
+        Checks the change log at most once per sync_interval seconds and
+        returns the thread started to catch up, if any
+        """
+        now = time.monotonic()
+        with self._lock:
+            loaded = self._synced_at is not None
+            if loaded and (self._syncing or
+                           now - self._synced_at < self.sync_interval):
+                return None
+            if loaded:
+                self._synced_at = now
+        if not loaded:
+            self._load(now)
+            return None
+
+        change_id = self._last_change_id()
+        with self._lock:
+            reconcile = self._reconciled_at is None or \
+                now - self._reconciled_at >= RECONCILE_INTERVAL
+            if self._syncing or not (change_id > self._change_id or
+                                     self._gaps or reconcile):
+                return None
+            self._syncing = True
+        thread = threading.Thread(
+            target=self._catch_up,
+            args=(current_app._get_current_object(), reconcile),
+            daemon=True)
+        thread.start()
+        return thread
+
+    def expire(self):
+        """Makes the next use sync, e.g. after a bulk import"""
+        with self._lock:
+            if self._synced_at is not None:
+                self._synced_at = time.monotonic() - self.sync_interval
+
+    def add(self, question):
+        with self._lock:
+            # before the first sync the whole table is still to be loaded
+            if self._synced_at is not None:
+                self._index(tuple(getattr(question, column.key)
+                                  for column in self.columns))
+
+    def remove(self, question_id):
+        with self._lock:
+            self._unindex(question_id)
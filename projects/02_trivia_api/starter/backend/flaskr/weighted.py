@@ -0,0 +1,52 @@
+import math
+import random
+
+# spread used when a quiz asks for a target difficulty without one
+DEFAULT_SPREAD = 1.0
+# narrower spreads make every difficulty but the target weigh nothing
+MIN_SPREAD = 0.1
+# range of the question difficulties, and of the targets a quiz can ask for
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+
+
+def difficulty_weight(difficulty, target, spread):
+    """Gaussian weight of a difficulty around target"""
+    return math.exp(-0.5 * ((difficulty - target) / spread) ** 2)
+
+
+'''
+AliasTable
+Walker's alias method with Vose's construction: draws an index with
+probability proportional to its weight in O(1), after an O(n) build
+'''
+
+
+class AliasTable:
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError('alias table needs a positive total weight')
+
+        self._probability = [0.0] * n
+        self._alias = list(range(n))
+        scaled = [weight * n / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self._probability[less] = scaled[less]
+            self._alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        # leftovers are 1 up to rounding errors
+        for i in small + large:
+            self._probability[i] = 1.0
+
+    def __len__(self):
+        return len(self._probability)
+
+    def draw(self, rng=random):
+        i = rng.randrange(len(self._probability))
+        return i if rng.random() < self._probability[i] else self._alias[i]
@@ -0,0 +1,24 @@
+--
+-- Full-text search over questions and answers
+-- Adds a tsvector column kept up to date by a trigger and a GIN index on it
+-- Apply after restoring trivia.psql: psql trivia < migrations/0001_question_search.sql
+--
+
+BEGIN;
+
+ALTER TABLE public.questions ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+UPDATE public.questions SET search_vector = to_tsvector(
+    'pg_catalog.english', coalesce(question, '') || ' ' || coalesce(answer, ''));
+
+CREATE INDEX IF NOT EXISTS questions_search_vector_idx
+    ON public.questions USING GIN (search_vector);
+
+DROP TRIGGER IF EXISTS questions_search_vector_update ON public.questions;
+
+CREATE TRIGGER questions_search_vector_update
+    BEFORE INSERT OR UPDATE OF question, answer ON public.questions
+    FOR EACH ROW EXECUTE PROCEDURE
+    tsvector_update_trigger(search_vector, 'pg_catalog.english', question, answer);
+
+COMMIT;
@@ -0,0 +1,48 @@
+--
+-- Integer, indexed foreign key for questions.category
+-- Existing dumps may hold the category as text, either the category id or
+-- its name. The backfill below converts both to categories.id and aborts
+-- the migration when a question matches no category: fix or delete those
+-- rows first, the error lists their ids.
+-- Apply in order: psql trivia < migrations/0002_question_category_fk.sql
+--
+
+BEGIN;
+
+ALTER TABLE public.questions ADD COLUMN category_id integer;
+
+-- backfill
+UPDATE public.questions AS q SET category_id = CASE
+    WHEN trim(q.category::text) ~ '^[0-9]+$' THEN trim(q.category::text)::integer
+    ELSE (SELECT c.id FROM public.categories AS c
+          WHERE lower(c.type) = lower(trim(q.category::text)))
+    END;
+
+DO $$
+DECLARE
+    unmapped text;
+BEGIN
+    SELECT string_agg(q.id::text, ', ' ORDER BY q.id) INTO unmapped
+        FROM public.questions AS q
+        WHERE q.category_id IS NULL
+            OR q.category_id NOT IN (SELECT id FROM public.categories);
+    IF unmapped IS NOT NULL THEN
+        RAISE EXCEPTION 'questions without a valid category: %', unmapped;
+    END IF;
+END
+$$;
+
+-- dropping the old column also drops any constraint defined on it
+ALTER TABLE public.questions DROP COLUMN category;
+ALTER TABLE public.questions RENAME COLUMN category_id TO category;
+ALTER TABLE public.questions ALTER COLUMN category SET NOT NULL;
+
+ALTER TABLE ONLY public.questions
+    ADD CONSTRAINT questions_category_fkey FOREIGN KEY (category)
+    REFERENCES public.categories(id) ON UPDATE CASCADE ON DELETE RESTRICT;
+
+CREATE INDEX questions_category_idx ON public.questions (category, id);
+
+ANALYZE public.questions;
+
+COMMIT;
@@ -0,0 +1,51 @@
+--
+-- Change log of the questions table
+-- Triggers log the id of every question inserted, updated or deleted, by
+-- any writer. The in-memory indexes of the api catch up from the log
+-- instead of scanning the table, and prune entries older than a day.
+-- Needs PostgreSQL 10 or later for the transition tables.
+-- Apply in order: psql trivia < migrations/0003_question_changes.sql
+--
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.question_changes (
+    id serial PRIMARY KEY,
+    question_id integer NOT NULL,
+    changed_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS question_changes_changed_at_idx
+    ON public.question_changes (changed_at);
+
+CREATE OR REPLACE FUNCTION public.log_question_changes() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO public.question_changes (question_id)
+            SELECT id FROM new_rows;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO public.question_changes (question_id)
+            SELECT id FROM old_rows UNION SELECT id FROM new_rows;
+    ELSE
+        INSERT INTO public.question_changes (question_id)
+            SELECT id FROM old_rows;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS questions_log_insert ON public.questions;
+DROP TRIGGER IF EXISTS questions_log_update ON public.questions;
+DROP TRIGGER IF EXISTS questions_log_delete ON public.questions;
+
+CREATE TRIGGER questions_log_insert AFTER INSERT ON public.questions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE public.log_question_changes();
+CREATE TRIGGER questions_log_update AFTER UPDATE ON public.questions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE public.log_question_changes();
+CREATE TRIGGER questions_log_delete AFTER DELETE ON public.questions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE public.log_question_changes();
+
+COMMIT;
@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, \
+    Index, DDL, create_engine, event, func
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -30,11 +31,18 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    # per-category listing and quiz queries are range scans on this index,
+    # see migrations/0002_question_category_fk.sql for existing databases
+    __table_args__ = (
+        Index('questions_category_idx', 'category', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey(
+        'categories.id', onupdate='CASCADE', ondelete='RESTRICT'),
+        nullable=False)
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -84,3 +92,73 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+
+'''
+QuestionChange
+log of the ids of the questions inserted, updated or deleted, filled by
+triggers on the questions table so that every writer is logged, bulk
+imports and other processes included. The in-memory indexes read it to
+catch up, see flaskr/synced.py; old entries are pruned by the indexes
+see migrations/0003_question_changes.sql for existing databases
+'''
+
+
+class QuestionChange(db.Model):
+    __tablename__ = 'question_changes'
+    # ids are never reused on sqlite either, even once the log is pruned
+    __table_args__ = (
+        Index('question_changes_changed_at_idx', 'changed_at'),
+        {'sqlite_autoincrement': True},
+    )
+
+    id = Column(Integer, primary_key=True)
+    question_id = Column(Integer, nullable=False)
+    changed_at = Column(DateTime(timezone=True), nullable=False,
+                        server_default=func.now())
+
+
+# one statement per DDL, sqlite runs a single statement at a time
+for statement in (
+        """CREATE TRIGGER IF NOT EXISTS questions_log_insert
+        AFTER INSERT ON questions BEGIN
+            INSERT INTO question_changes (question_id) VALUES (NEW.id);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS questions_log_update
+        AFTER UPDATE ON questions BEGIN
+            INSERT INTO question_changes (question_id)
+                VALUES (OLD.id), (NEW.id);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS questions_log_delete
+        AFTER DELETE ON questions BEGIN
+            INSERT INTO question_changes (question_id) VALUES (OLD.id);
+        END"""):
+    event.listen(Question.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+
+# statement triggers log a whole COPY or multi-row write at once
+event.listen(Question.__table__, 'after_create', DDL("""
+CREATE OR REPLACE FUNCTION log_question_changes() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO question_changes (question_id) SELECT id FROM new_rows;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO question_changes (question_id)
+            SELECT id FROM old_rows UNION SELECT id FROM new_rows;
+    ELSE
+        INSERT INTO question_changes (question_id) SELECT id FROM old_rows;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER questions_log_insert AFTER INSERT ON questions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE log_question_changes();
+CREATE TRIGGER questions_log_update AFTER UPDATE ON questions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE log_question_changes();
+CREATE TRIGGER questions_log_delete AFTER DELETE ON questions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE log_question_changes();
+""").execute_if(dialect='postgresql'))
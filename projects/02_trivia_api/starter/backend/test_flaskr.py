@@ -4,6 +4,7 @@ import json
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
+from flaskr.quiz_index import QuizIndex
 from models import setup_db, Question, Category
 
 
@@ -56,6 +57,16 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data["categories"]))
         self.assertTrue(len(data["current_category"]))
 
+    def test_get_questions_after_id(self):
+        """Test retrieving the page of questions following an id"""
+        res = self.client().get('/questions?after_id=17')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertTrue(len(data["questions"]))
+        self.assertTrue(
+            all(question["id"] > 17 for question in data["questions"]))
+
     def test_404_sent_requesting_beyond_valid_page(self):
         """Test if receive 404 when requesting beyond valid page"""
         res = self.client().get('/questions?page=1000000')
@@ -100,6 +111,50 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data["categories"]))
         self.assertTrue(len(data["current_category"]))
 
+    def test_create_and_delete_question_minimal(self):
+        """Test ?return=minimal answers with the id and counts only"""
+        questions_before = Question.query.count()
+        res = self.client().post(
+            '/questions?return=minimal', json=self.new_question)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["total_questions"], questions_before + 1)
+        self.assertTrue(data["category_questions"])
+        self.assertNotIn('questions', data)
+        question_id = data['created']
+
+        res = self.client().delete(
+            '/questions/{}?return=minimal'.format(question_id))
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], question_id)
+        self.assertEqual(data["total_questions"], questions_before)
+        self.assertNotIn('questions', data)
+
+    def test_409_if_near_duplicate_question_is_rejected(self):
+        """Test rejecting a rewording of an existing question"""
+        questions_before = Question.query.count()
+        res = self.client().post('/questions?duplicates=reject', json={
+            'question':
+                'Which dung beetle was worshiped by ancient Egyptians?',
+            'answer': 'Scarab',
+            'difficulty': 4,
+            'category': 3})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data['duplicates'][0]['id'], 23)
+        self.assertEqual(Question.query.count(), questions_before)
+
+    def test_get_duplicate_questions(self):
+        """Test the near-duplicate report of the question bank"""
+        res = self.client().get('/questions/duplicates')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data['total_groups'], len(data['groups']))
+
     def test_405_if_question_creation_not_allowed(self):
         """Test creating a new question with wrong endpoint"""
         res = self.client().post('/questions/100', json=self.new_question)
@@ -109,6 +164,69 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "method not allowed")
 
+    def test_import_and_export_questions(self):
+        """Test importing ndjson questions and finding them in the export"""
+        rows = [{'question': 'Bulk imported question {}?'.format(i),
+                 'answer': 'Yes',
+                 'category': 2,
+                 'difficulty': 1} for i in range(2)]
+        res = self.client().post(
+            '/questions/import',
+            data=''.join(json.dumps(row) + '\n' for row in rows),
+            content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data['imported'], 2)
+
+        res = self.client().get('/questions/export')
+        self.assertEqual(res.status_code, 200)
+        exported = [json.loads(line) for line in res.data.splitlines()]
+        imported = [question for question in exported
+                    if question['question'].startswith('Bulk imported')]
+        self.assertEqual(
+            [question['question'] for question in imported],
+            [row['question'] for row in rows])
+
+        Question.query.filter(
+            Question.question.like('Bulk imported%')).delete(
+            synchronize_session=False)
+        Question.query.session.commit()
+
+    def test_422_if_imported_row_is_invalid(self):
+        """Test an import with an invalid row inserts nothing"""
+        res = self.client().post(
+            '/questions/import',
+            data='question,answer,category,difficulty\n'
+                 'Imported?,Yes,2,1\n'
+                 'Imported?,Yes,two,1\n',
+            content_type='text/csv')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"],
+                         'line 3: category and difficulty must be integers')
+        self.assertEqual(
+            Question.query.filter_by(question='Imported?').count(), 0)
+
+    def test_422_if_imported_category_does_not_exist(self):
+        """Test an import with an unknown category or difficulty"""
+        for row, message in (
+                ({'category': 99, 'difficulty': 1},
+                 'line 1: unknown category 99'),
+                ({'category': 2, 'difficulty': 9},
+                 'line 1: difficulty must be between 1 and 5')):
+            res = self.client().post(
+                '/questions/import',
+                data=json.dumps(dict(
+                    row, question='Imported?', answer='Yes')) + '\n',
+                content_type='application/x-ndjson')
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(data["message"], message)
+        self.assertEqual(
+            Question.query.filter_by(question='Imported?').count(), 0)
+
     def test_get_question_search_with_results(self):
         """Test getting questions from search results"""
         res = self.client().post('/questions', json={'searchTerm': 'Anne'})
@@ -190,6 +308,160 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertEqual(data['question']['id'], 9)
 
+    def test_get_next_quiz_question_category_exhausted(self):
+        """Test quiz returns no question once the category was served"""
+        res = self.client().post(
+            '/quizzes',
+            json={
+                'quiz_category': {
+                    'type': 'Science',
+                    'id': 0},
+                'previous_questions': [20, 21, 22]})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data['question'], None)
+
+    def test_get_next_quiz_question_created_after_delete(self):
+        """Test quiz serves a question created after deleting another one"""
+        question = dict(self.new_question, category=0)
+        res = self.client().post('/questions', json=question)
+        self.client().delete(
+            '/questions/{}'.format(json.loads(res.data)['created']))
+        res = self.client().post('/questions', json=question)
+        question_id = json.loads(res.data)['created']
+
+        res = self.client().post(
+            '/quizzes',
+            json={
+                'quiz_category': {
+                    'type': 'Science',
+                    'id': 0},
+                'previous_questions': [20, 21, 22]})
+        data = json.loads(res.data)
+        self.client().delete('/questions/{}'.format(question_id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], question_id)
+
+    def test_quiz_index_follows_other_writers(self):
+        """Test the quiz index reloads the rows logged by another writer"""
+        with self.app.app_context():
+            index = QuizIndex(sync_interval=0)
+            index.sync()
+            question = Question(**dict(self.new_question, category=1))
+            Question.query.session.add(question)
+            Question.query.session.commit()
+            question_id = question.id
+            # the id is reused in another category behind the index's back
+            Question.query.filter(Question.id == question_id).delete()
+            Question.query.session.execute(Question.__table__.insert(
+                ).values(dict(self.new_question, id=question_id, category=2)))
+            Question.query.session.commit()
+
+            index.sync().join()
+            science, _ = index.snapshot(1)
+            art, _ = index.snapshot(2)
+            Question.query.filter(Question.id == question_id).delete()
+            Question.query.session.commit()
+
+        self.assertNotIn(question_id, science)
+        self.assertIn(question_id, art)
+
+    def test_get_next_quiz_question_target_difficulty(self):
+        """Test a narrow spread only serves the target difficulty"""
+        for _ in range(10):
+            res = self.client().post('/quizzes', json={
+                'quiz_category': {
+                    'type': 'click',
+                    'id': 0},
+                'previous_questions': [],
+                'difficulty': 1,
+                'spread': 0.1})
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['question']['difficulty'], 1)
+
+    def test_400_if_quiz_spread_is_invalid(self):
+        """Test a quiz with a spread below the minimum"""
+        res = self.client().post('/quizzes', json={
+            'quiz_category': {
+                'type': 'click',
+                'id': 0},
+            'previous_questions': [],
+            'difficulty': 3,
+            'spread': 0})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
+    def test_400_if_quiz_difficulty_is_out_of_range(self):
+        """Test a quiz with a target difficulty outside 1 to 5"""
+        for difficulty in (0, 6, 1e200):
+            res = self.client().post('/quizzes', json={
+                'quiz_category': {
+                    'type': 'click',
+                    'id': 0},
+                'previous_questions': [],
+                'difficulty': difficulty})
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data["success"], False)
+
+    def test_quiz_session_serves_each_question_once(self):
+        """Test a quiz session serves every question of its category once"""
+        res = self.client().post('/quizzes/sessions', json={
+            'quiz_category': {
+                'type': 'Science',
+                'id': 0}})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        session_id = data['session_id']
+
+        served = []
+        for _ in range(4):
+            res = self.client().post(
+                '/quizzes/sessions/{}/next'.format(session_id))
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            served.append(data['question'])
+
+        self.assertEqual(served[-1], None)
+        self.assertEqual(
+            sorted(question['id'] for question in served[:-1]), [20, 21, 22])
+
+    def test_quiz_session_seed_replays_the_same_deck(self):
+        """Test two quiz sessions with the same seed serve the same order"""
+        orders = []
+        for _ in range(2):
+            res = self.client().post('/quizzes/sessions', json={
+                'quiz_category': {
+                    'type': 'click',
+                    'id': 0},
+                'seed': 1234})
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['seed'], 1234)
+            self.assertTrue(data['deck_version'])
+            session_id = data['session_id']
+
+            order = []
+            for _ in range(data['total_questions']):
+                res = self.client().post(
+                    '/quizzes/sessions/{}/next'.format(session_id))
+                order.append(json.loads(res.data)['question']['id'])
+            orders.append(order)
+
+        self.assertEqual(orders[0], orders[1])
+        self.assertEqual(len(set(orders[0])), len(orders[0]))
+
+    def test_404_if_quiz_session_does_not_exist(self):
+        """Test requesting a question of an unknown quiz session"""
+        res = self.client().post('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
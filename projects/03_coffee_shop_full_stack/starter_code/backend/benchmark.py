@@ -0,0 +1,237 @@
+"""Load test and latency benchmark for the coffee shop api
+
+Starts the app against a temporary sqlite database and a local JWKS
+stand-in, mints tokens carrying each permission and drives every route
+at the requested concurrency. Latency percentiles and requests per
+second are written per route to a JSON file so results can be compared
+between versions.
+
+EXAMPLE
+    python benchmark.py --concurrency 16 --requests 2000 \\
+        --output benchmark-results.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from local_idp import LocalIdentityProvider
+from src.auth import auth
+from src.database.models import db, Drink
+from src.menu_cache import menu_cache
+from src import timing
+
+BARISTA = ['get:drinks-detail']
+MANAGER = ['get:drinks-detail', 'post:drinks', 'patch:drinks',
+           'delete:drinks', 'get:stats']
+
+
+def recipe(i):
+    return [{'name': 'milk', 'color': 'white', 'parts': 1 + i % 3},
+            {'name': 'coffee', 'color': 'brown', 'parts': 1}]
+
+
+def load_app(database_file, sqlite_profile=None):
+    """Imports the api bound to database_file
+    setup_db runs when src.api is imported, so the settings it reads are
+    handed over through COFFEE_SHOP_SETTINGS beforehand
+    """
+    fd, settings_file = tempfile.mkstemp(suffix='.cfg')
+    with os.fdopen(fd, 'w') as f:
+        f.write('SQLALCHEMY_DATABASE_URI = {!r}\n'.format(
+            'sqlite:///' + database_file))
+        f.write('SQLITE_ENGINE_PROFILE = {!r}\n'.format(sqlite_profile))
+    os.environ['COFFEE_SHOP_SETTINGS'] = settings_file
+    try:
+        from src.api import app
+    finally:
+        os.remove(settings_file)
+    return app
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def percentile(latencies, p):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = max(int(round(p / 100 * len(latencies) + 0.5)) - 1, 0)
+    return latencies[min(rank, len(latencies) - 1)]
+
+
+class Benchmark:
+    def __init__(self, menu_size, concurrency, requests):
+        self.menu_size = menu_size
+        self.concurrency = concurrency
+        self.requests = requests
+        self._counter = itertools.count()
+
+    def setup(self, sqlite_profile=None):
+        fd, self.database_file = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.app = app = load_app(self.database_file, sqlite_profile)
+
+        # DELETE needs rows of its own, one per request
+        with app.app_context():
+            db.create_all()
+            Drink.bulk_insert([{
+                'title': 'Drink {}'.format(i),
+                'recipe': json.dumps(recipe(i))
+            } for i in range(self.menu_size + self.requests)])
+            self.menu_ids = list(range(1, self.menu_size + 1))
+            self.delete_ids = iter(range(
+                self.menu_size + 1, self.menu_size + self.requests + 1))
+        menu_cache.invalidate()
+
+        self.idp = LocalIdentityProvider()
+        auth.configure_jwks(self.idp.start())
+        self.barista = self.idp.headers(BARISTA)
+        self.manager = self.idp.headers(MANAGER)
+
+        self.server = make_server(
+            '127.0.0.1', 0, app, threaded=True,
+            request_handler=QuietRequestHandler)
+        threading.Thread(
+            target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def teardown(self):
+        self.server.shutdown()
+        self.idp.stop()
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.database_file + suffix):
+                os.remove(self.database_file + suffix)
+
+    def unique_title(self):
+        return 'Bench {}'.format(next(self._counter))
+
+    def routes(self):
+        """Yields (name, request factory) for every route of the api"""
+        etag = urlopen(self.base_url + '/drinks').headers['ETag']
+
+        def request(method, path, headers=None, body=None):
+            data = None if body is None else json.dumps(body).encode()
+            headers = dict(headers or {})
+            if data is not None:
+                headers['Content-Type'] = 'application/json'
+            return Request(self.base_url + path, data=data,
+                           headers=headers, method=method)
+
+        yield 'GET /drinks', lambda: request('GET', '/drinks')
+        yield 'GET /drinks (304)', lambda: request(
+            'GET', '/drinks', {'If-None-Match': etag})
+        yield 'GET /drinks-detail', lambda: request(
+            'GET', '/drinks-detail', self.barista)
+        yield 'POST /drinks', lambda: request(
+            'POST', '/drinks', self.manager,
+            {'title': self.unique_title(), 'recipe': recipe(0)})
+        yield 'PATCH /drinks/<id>', lambda: request(
+            'PATCH', '/drinks/{}'.format(self.menu_ids[
+                next(self._counter) % len(self.menu_ids)]),
+            self.manager,
+            {'title': self.unique_title(), 'recipe': recipe(1)})
+        yield 'DELETE /drinks/<id>', lambda: request(
+            'DELETE', '/drinks/{}'.format(next(self.delete_ids)),
+            self.manager)
+        yield 'POST /drinks/bulk', lambda: request(
+            'POST', '/drinks/bulk', self.manager,
+            [{'title': self.unique_title(), 'recipe': recipe(i)}
+             for i in range(10)])
+        yield 'GET /internal/stats', lambda: request(
+            'GET', '/internal/stats', self.manager)
+
+    def timed(self, make_request):
+        req = make_request()
+        start = time.perf_counter()
+        try:
+            with urlopen(req) as res:
+                res.read()
+            ok = True
+        except HTTPError as e:
+            ok = e.code == 304
+        return time.perf_counter() - start, ok
+
+    def run_route(self, make_request):
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            start = time.perf_counter()
+            results = list(pool.map(
+                lambda _: self.timed(make_request), range(self.requests)))
+            elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency * 1000 for latency, _ in results)
+        return {
+            'requests': len(results),
+            'errors': sum(1 for _, ok in results if not ok),
+            'mean_ms': statistics.mean(latencies),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'requests_per_second': len(results) / elapsed
+        }
+
+    def run(self):
+        return {name: self.run_route(make_request)
+                for name, make_request in self.routes()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests sent to each route')
+    parser.add_argument('--menu-size', type=int, default=50)
+    parser.add_argument('--sqlite-profile', default=None,
+                        help="e.g. 'production', see setup_db")
+    parser.add_argument('--no-token-cache', action='store_true',
+                        help='run a full jwt.decode on every request')
+    parser.add_argument('--no-menu-cache', action='store_true',
+                        help='rebuild the menu snapshot on every read')
+    parser.add_argument('--output', default='benchmark-results.json')
+    args = parser.parse_args()
+
+    if args.no_token_cache:
+        auth.configure_token_cache(0)
+    if args.no_menu_cache:
+        menu_cache.max_age = 0
+
+    benchmark = Benchmark(args.menu_size, args.concurrency, args.requests)
+    benchmark.setup(args.sqlite_profile)
+    try:
+        routes = benchmark.run()
+    finally:
+        benchmark.teardown()
+
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'settings': vars(args),
+        'routes': routes,
+        'server_timings': timing.stats()
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for name, route in routes.items():
+        print('{:<22} p50 {:7.2f}ms  p95 {:7.2f}ms  p99 {:7.2f}ms  '
+              '{:8.1f} req/s  {} errors'.format(
+                  name, route['p50_ms'], route['p95_ms'], route['p99_ms'],
+                  route['requests_per_second'], route['errors']))
+    print('results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+from src.auth import auth
+
+
+def b64_int(value):
+    length = (value.bit_length() + 7) // 8
+    return base64.urlsafe_b64encode(
+        value.to_bytes(length, 'big')).rstrip(b'=').decode('ascii')
+
+
+'''
+LocalIdentityProvider
+offline stand-in for Auth0, used by the tests and the benchmark
+generates an RSA keypair, serves its public half as a JWKS on
+127.0.0.1 and mints RS256 tokens that requires_auth accepts
+EXAMPLE
+    idp = LocalIdentityProvider()
+    auth.configure_jwks(idp.start())
+    headers = idp.headers(['get:drinks-detail'])
+'''
+
+
+class LocalIdentityProvider:
+    def __init__(self, kid='local-key', bits=2048):
+        key = RSA.generate(bits)
+        self.kid = kid
+        self.private_key = key.export_key().decode('ascii')
+        self.jwks = {'keys': [{
+            'kty': 'RSA',
+            'kid': kid,
+            'use': 'sig',
+            'n': b64_int(key.n),
+            'e': b64_int(key.e)
+        }]}
+        self.requests = 0
+        self._server = None
+
+    def start(self):
+        """Serves the JWKS in a background thread and returns its url"""
+        idp = self
+
+        class JWKSHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                idp.requests += 1
+                body = json.dumps(idp.jwks).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), JWKSHandler)
+        threading.Thread(
+            target=self._server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/.well-known/jwks.json'
+
+    def token(self, permissions, expires_in=3600):
+        now = int(time.time())
+        return jwt.encode({
+            'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+            'aud': auth.API_AUDIENCE,
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': list(permissions)
+        }, self.private_key, algorithm='RS256', headers={'kid': self.kid})
+
+    def headers(self, permissions, expires_in=3600):
+        return {
+            'Authorization': 'Bearer ' + self.token(permissions, expires_in)
+        }
@@ -4,12 +4,19 @@ from sqlalchemy import exc
 import json
 from flask_cors import CORS
 
-from .database.models import db_drop_and_create_all, setup_db, Drink
+from .database.models import db_drop_and_create_all, setup_db, db, Drink
+from .auth import auth
 from .auth.auth import AuthError, requires_auth
+from .menu_cache import menu_cache
+from .menu_feed import menu_feed
+from . import timing
 
 app = Flask(__name__)
+# optional settings file, e.g. to enable SQLITE_ENGINE_PROFILE
+app.config.from_envvar('COFFEE_SHOP_SETTINGS', silent=True)
 setup_db(app)
 CORS(app)
+timing.init_app(app)
 
 '''
 @TODO uncomment the following line to initialize the database
@@ -21,33 +28,65 @@ CORS(app)
 # ROUTES
 
 
+# Menu reads are served from the pre-encoded snapshot in menu_cache,
+# every write path below must invalidate it after committing
+
+def menu_response(body, etag):
+    """Builds a menu response carrying etag
+    Answers 304 Not Modified when it matches If-None-Match
+    """
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
 @app.route('/drinks')
 def get_drinks():
-    drinks = Drink.query.order_by(Drink.id).all()
+    snapshot = menu_cache.get()
 
-    if len(drinks) == 0:
+    if snapshot.count == 0:
         abort(404)
 
-    return jsonify(
-        {'success': True,
-         'drinks': [
-             drink.short() for drink in drinks]
-         })
+    return menu_response(snapshot.short_body, snapshot.short_etag)
 
 
 @app.route('/drinks-detail')
 @requires_auth('get:drinks-detail')
 def get_drinks_detail(payload):
-    drinks = Drink.query.order_by(Drink.id).all()
+    snapshot = menu_cache.get()
 
-    if len(drinks) == 0:
+    if snapshot.count == 0:
         abort(404)
 
-    return jsonify(
-        {'success': True,
-         'drinks': [
-             drink.long() for drink in drinks]
-         })
+    return menu_response(snapshot.long_body, snapshot.long_etag)
+
+
+@app.route('/drinks/stream')
+def stream_drinks():
+    """Server-Sent Events feed of menu changes
+    Reconnecting clients resume after their Last-Event-ID
+    """
+    last_event_id = request.headers.get(
+        'Last-Event-ID', request.args.get('last_event_id', None)) or None
+
+    response = app.response_class(
+        menu_feed.stream(last_event_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def publish_drink(kind, drink):
+    """Publishes a created or updated drink to the menu feed
+    A drink without a short form, e.g. with a null recipe, is published
+    as a reset so clients refetch the menu
+    """
+    try:
+        short = drink.short()
+    except (TypeError, KeyError):
+        menu_feed.publish('reset')
+        return
+    menu_feed.publish(kind, drink.id, short)
 
 
 @app.route('/drinks', methods=['POST'])
@@ -63,14 +102,126 @@ def create_new_drink(payload):
             title=title,
             recipe=recipe)
         drink.insert()
-
-        return jsonify({
-            'success': True,
-            'drinks': [drink.long()]
-        })
     except BaseException:
         abort(422)
 
+    # committed, notifying the caches and the feed never fails the write
+    menu_cache.invalidate()
+    publish_drink('created', drink)
+
+    return jsonify({
+        'success': True,
+        'drinks': [drink.long()]
+    })
+
+
+
+def read_bulk_drinks():
+    """Yields the drinks of a bulk import request
+    Accepts a json array, or an ndjson stream with one drink per line
+    """
+    if request.mimetype == 'application/x-ndjson':
+        for line in request.stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        body = request.get_json(silent=True)
+        if not isinstance(body, list):
+            raise ValueError('Expected a list of drinks.')
+        yield from body
+
+
+def validate_bulk_drink(item):
+    """Returns the title and encoded recipe of a bulk import item
+    Raises ValueError describing the first problem found
+    """
+    if not isinstance(item, dict):
+        raise ValueError('Drink must be an object.')
+
+    title = item.get('title', None)
+    if not isinstance(title, str) or not title.strip() or len(title) > 80:
+        raise ValueError('Invalid title.')
+
+    recipe = item.get('recipe', None)
+    if not isinstance(recipe, list) or len(recipe) == 0:
+        raise ValueError('Recipe must be a list of ingredients.')
+    for ingredient in recipe:
+        if not isinstance(ingredient, dict) or \
+                not isinstance(ingredient.get('name'), str) or \
+                not isinstance(ingredient.get('color'), str) or \
+                not isinstance(ingredient.get('parts'), (int, float)):
+            raise ValueError('Invalid ingredient.')
+
+    return title, json.dumps(recipe)
+
+
+@app.route('/drinks/bulk', methods=['POST'])
+@requires_auth('post:drinks')
+def create_drinks_in_bulk(payload):
+    try:
+        items = list(read_bulk_drinks())
+    except ValueError:
+        abort(400)
+
+    rows = []
+    errors = []
+    indexes = {}
+    for index, item in enumerate(items):
+        try:
+            title, recipe = validate_bulk_drink(item)
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+
+        if title in indexes:
+            errors.append({
+                'index': index,
+                'title': title,
+                'error': 'Duplicate title.'})
+            continue
+
+        indexes[title] = index
+        rows.append({'title': title, 'recipe': recipe})
+
+    # Conflicts on the unique title are reported per item and skipped,
+    # the rest of the batch is still inserted. A title taken by another
+    # request between the check and the insert fails the insert, the
+    # titles are then checked again and the insert retried without it
+    retried = False
+    while True:
+        existing = Drink.existing_titles(row['title'] for row in rows)
+        if retried and not existing:
+            # the integrity error was not a title conflict
+            abort(422)
+        for title in existing:
+            errors.append({
+                'index': indexes[title],
+                'title': title,
+                'error': 'Duplicate title.'})
+        rows = [row for row in rows if row['title'] not in existing]
+
+        try:
+            Drink.bulk_insert(rows)
+            break
+        except exc.IntegrityError:
+            db.session.rollback()
+            retried = True
+        except exc.SQLAlchemyError:
+            db.session.rollback()
+            abort(422)
+    errors.sort(key=lambda error: error['index'])
+
+    # executemany does not hand back the new ids, so clients refetch
+    if rows:
+        menu_cache.invalidate()
+        menu_feed.publish('reset')
+
+    return jsonify({
+        'success': True,
+        'created': len(rows),
+        'errors': errors
+    })
+
 
 @app.route('/drinks/<drink_id>', methods=['PATCH'])
 @requires_auth('patch:drinks')
@@ -88,14 +239,17 @@ def edit_drink(payload, drink_id):
             drink.title = title
             drink.recipe = recipe
             drink.update()
-
-            return jsonify({
-                'success': True,
-                'drinks': [drink.long()]
-            })
         except BaseException:
             abort(422)
 
+        menu_cache.invalidate()
+        publish_drink('updated', drink)
+
+        return jsonify({
+            'success': True,
+            'drinks': [drink.long()]
+        })
+
 
 @app.route('/drinks/<drink_id>', methods=['DELETE'])
 @requires_auth('delete:drinks')
@@ -106,14 +260,37 @@ def delete_drink(payload, drink_id):
     else:
         try:
             drink.delete()
-
-            return jsonify({
-                'success': True,
-                'delete': drink_id
-            })
         except BaseException:
             abort(422)
 
+        menu_cache.invalidate()
+        menu_feed.publish('deleted', int(drink_id))
+
+        return jsonify({
+            'success': True,
+            'delete': drink_id
+        })
+
+
+@app.route('/internal/stats')
+@requires_auth('get:stats')
+def get_stats(payload):
+    return jsonify({
+        'success': True,
+        'timings': timing.stats(),
+        'token_cache': {
+            'hits': auth.token_cache.hits,
+            'misses': auth.token_cache.misses,
+            'size': len(auth.token_cache)
+        },
+        'jwks': {
+            'hits': auth.jwks_store.hits,
+            'misses': auth.jwks_store.misses,
+            'fetches': auth.jwks_store.fetches
+        },
+        'menu_version': menu_cache.version
+    })
+
 
 # Error Handling
 
@@ -126,6 +303,15 @@ def unprocessable(error):
     }), 422
 
 
+@app.errorhandler(400)
+def bad_request(error):
+    return jsonify({
+      "success": False,
+      "error": 400,
+      "message": "bad request"
+    }), 400
+
+
 @app.errorhandler(404)
 def resource_not_found(error):
     return jsonify({
@@ -1,13 +1,28 @@
+import hashlib
 import json
+import threading
+import time
+from collections import OrderedDict
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
 
+from ..timing import timed
+
 
 AUTH0_DOMAIN = 'fsnd-bn.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'coffeeshop'
+JWKS_URL = f'https://{AUTH0_DOMAIN}/.well-known/jwks.json'
+# seconds a fetched key set stays valid
+JWKS_CACHE_TTL = 600
+# minimum seconds between refetches, whether expired or for an unknown kid
+JWKS_MIN_REFRESH_INTERVAL = 30
+# seconds before a fetch of the key set is given up
+JWKS_FETCH_TIMEOUT = 5
+# maximum number of verified token payloads kept in memory
+TOKEN_CACHE_SIZE = 1024
 
 # AuthError Exception
 '''
@@ -22,6 +37,213 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+# JWKS Key Store
+'''
+JWKSKeyStore
+Process-wide cache of the signing keys published at the JWKS url
+The url may also be a file:// url pointing at a local key set
+'''
+
+
+class JWKSKeyStore:
+    def __init__(self, url=JWKS_URL, ttl=JWKS_CACHE_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                 timeout=JWKS_FETCH_TIMEOUT):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self._keys = {}
+        self._expires_at = 0
+        self._last_fetch = None
+        self._failed = False
+        self._fetching = False
+        self._lock = threading.Lock()
+        # held during a fetch, so only one request at a time fetches
+        self._refresh_lock = threading.Lock()
+
+    def _fetch(self):
+        with urlopen(self.url, timeout=self.timeout) as jsonurl:
+            jwks = json.loads(jsonurl.read())
+        return {
+            key['kid']: {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            } for key in jwks['keys']}
+
+    def _refresh_due(self, now):
+        return self._last_fetch is None or \
+            now - self._last_fetch >= self.min_refresh_interval
+
+    def _cached(self, kid):
+        # keys of the last successful fetch, even past their ttl
+        key = self._keys.get(kid)
+        if key is None and self._failed:
+            raise AuthError({
+                'code': 'jwks_unavailable',
+                'description': 'Unable to fetch the signing keys.'
+            }, 503)
+        return key or {}
+
+    def _refresh(self, kid):
+        with self._lock:
+            now = time.monotonic()
+            if not self._refresh_due(now):
+                # refreshed, or failed, while this request waited
+                return self._cached(kid)
+            # Recorded before fetching so a failing endpoint is rate limited too
+            self._last_fetch = now
+            self.fetches += 1
+            self._fetching = True
+
+        try:
+            keys = self._fetch()
+        except (OSError, ValueError, KeyError, TypeError):
+            with self._lock:
+                self._fetching = False
+                self._failed = True
+                return self._cached(kid)
+
+        with self._lock:
+            self._fetching = False
+            self._keys = keys
+            self._expires_at = now + self.ttl
+            self._failed = False
+            return keys.get(kid, {})
+
+    def get_key(self, kid):
+        """Returns the rsa key for kid, or an empty dict if it is unknown
+        Keys are built once per fetch and expire after ttl seconds. Expired
+        keys and unknown kids trigger a refetch at most once per
+        min_refresh_interval seconds, in between and when the endpoint
+        fails the keys of the last successful fetch keep being served.
+        Raises AuthError when there are none to serve
+        """
+        with self._lock:
+            now = time.monotonic()
+            key = self._keys.get(kid)
+            if key is not None and now < self._expires_at:
+                self.hits += 1
+                return key
+
+            self.misses += 1
+            # without a key, a request waits for a fetch in flight even
+            # though it is too early to start another one
+            waits = key is None and self._fetching
+            if not self._refresh_due(now) and not waits:
+                return self._cached(kid)
+
+        # a request holding an expired key serves it while another one
+        # refetches, the others wait for that fetch, bounded by timeout
+        if not self._refresh_lock.acquire(blocking=key is None):
+            return key
+        try:
+            return self._refresh(kid)
+        finally:
+            self._refresh_lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._expires_at = 0
+            self._last_fetch = None
+            self._failed = False
+            self._fetching = False
+            self.hits = 0
+            self.misses = 0
+            self.fetches = 0
+
+
+jwks_store = JWKSKeyStore()
+
+
+def configure_jwks(url=JWKS_URL, ttl=JWKS_CACHE_TTL,
+                   min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                   timeout=JWKS_FETCH_TIMEOUT):
+    """Replaces the process-wide key store
+    Useful to point verification at a local JWKS file or stand-in server
+    """
+    global jwks_store
+    jwks_store = JWKSKeyStore(url, ttl, min_refresh_interval, timeout)
+    return jwks_store
+
+
+# Verified Token Cache
+'''
+TokenCache
+LRU cache of verified token payloads keyed by a hash of the token
+An entry never outlives the exp claim of its token
+'''
+
+
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        """Returns the cached payload for token, or None
+        Expired entries are dropped so the token goes through full
+        verification again and fails with token_expired
+        """
+        key = self._key(token)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None and payload['exp'] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return payload
+
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, token, payload):
+        # Without an exp claim there is no safe lifetime for the entry
+        if self.maxsize <= 0 or 'exp' not in payload:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+token_cache = TokenCache()
+
+
+def configure_token_cache(maxsize=TOKEN_CACHE_SIZE):
+    """Replaces the process-wide verified token cache
+    A maxsize of 0 disables caching
+    """
+    global token_cache
+    token_cache = TokenCache(maxsize)
+    return token_cache
+
+
 # Auth Header
 
 def get_token_auth_header():
@@ -79,34 +301,25 @@ def verify_decode_jwt(token):
     """Verifies Auth0 jwt
     Using implementation as shown during Auth course
     """
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    with timed('jwks'):
+        rsa_key = jwks_store.get_key(unverified_header['kid'])
     if rsa_key:
         try:
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
+            with timed('jwt_decode'):
+                payload = jwt.decode(
+                    token,
+                    rsa_key,
+                    algorithms=ALGORITHMS,
+                    audience=API_AUDIENCE,
+                    issuer='https://' + AUTH0_DOMAIN + '/'
+                )
 
             return payload
 
@@ -133,14 +346,23 @@ def verify_decode_jwt(token):
     }, 400)
 
 
+# Every phase is timed, see src/timing.py for how durations are reported
+
 def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
+            with timed('auth_header'):
+                token = get_token_auth_header()
+            with timed('token_cache'):
+                payload = token_cache.get(token)
+            if payload is None:
+                payload = verify_decode_jwt(token)
+                token_cache.put(token, payload)
+            with timed('permissions'):
+                check_permissions(permission, payload)
+            with timed('view'):
+                return f(payload, *args, **kwargs)
 
         return wrapper
     return requires_auth_decorator
@@ -1,5 +1,8 @@
 import os
-from sqlalchemy import Column, String, Integer
+from functools import partial
+from sqlalchemy import Column, String, Integer, event
+from sqlalchemy.orm import reconstructor, validates
+from sqlalchemy.pool import QueuePool
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -10,17 +13,65 @@ database_path = "sqlite:///{}".format(os.path.join(
 
 db = SQLAlchemy()
 
+# defaults of the opt-in 'production' sqlite engine profile,
+# each one can be overridden from app config
+SQLITE_PROFILE_DEFAULTS = {
+    'SQLITE_BUSY_TIMEOUT': 5000,            # milliseconds
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,  # bytes
+    'SQLITE_CACHE_SIZE': -64000,            # negative means KiB
+    'SQLITE_POOL_SIZE': 5,
+    'SQLITE_MAX_OVERFLOW': 10
+}
+
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    set SQLITE_ENGINE_PROFILE = 'production' in app config to enable
+    WAL journaling and the other pragmas in set_sqlite_pragmas
 '''
 
 
 def setup_db(app):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config.setdefault("SQLALCHEMY_DATABASE_URI", database_path)
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    production = app.config.get("SQLITE_ENGINE_PROFILE") == 'production'
+    if production:
+        for key, value in SQLITE_PROFILE_DEFAULTS.items():
+            app.config.setdefault(key, value)
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {}).update({
+            # reuse connections across threads instead of reopening the
+            # file and replaying the pragmas on every request
+            'poolclass': QueuePool,
+            'pool_size': app.config['SQLITE_POOL_SIZE'],
+            'max_overflow': app.config['SQLITE_MAX_OVERFLOW'],
+            'connect_args': {'check_same_thread': False}
+        })
     db.app = app
     db.init_app(app)
+    if production:
+        with app.app_context():
+            event.listen(db.get_engine(app), 'connect',
+                         partial(set_sqlite_pragmas, app.config))
+
+
+'''
+set_sqlite_pragmas(config, dbapi_connection, connection_record)
+    connect event listener of the production engine profile
+    WAL lets readers proceed while a writer holds the database
+'''
+
+
+def set_sqlite_pragmas(config, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout={:d}'.format(
+        config['SQLITE_BUSY_TIMEOUT']))
+    cursor.execute('PRAGMA mmap_size={:d}'.format(
+        config['SQLITE_MMAP_SIZE']))
+    cursor.execute('PRAGMA cache_size={:d}'.format(
+        config['SQLITE_CACHE_SIZE']))
+    cursor.close()
 
 
 '''
@@ -53,20 +104,52 @@ class Drink(db.Model):
     # [{'color': string, 'name':string, 'parts':number}]
     recipe = Column(String(180), nullable=False)
 
+    '''
+    _parse_recipe()
+        parses the recipe blob once per load or write
+        the short form is derived from it on first use
+    '''
+    def _parse_recipe(self, recipe):
+        if getattr(self, '_recipe_source', None) == recipe:
+            return
+        self._parsed_recipe = json.loads(recipe)
+        self._short_recipe = None
+        self._recipe_source = recipe
+
+    @reconstructor
+    def _init_on_load(self):
+        self._parse_recipe(self.recipe)
+
+    @validates('recipe')
+    def _validate_recipe(self, key, recipe):
+        self._parse_recipe(recipe)
+        return recipe
+
+    '''
+    _current_recipe()
+        returns the parsed recipe of the current blob
+        reading recipe reloads an expired row, e.g. after a commit, and
+        the blob is only parsed again if it changed
+    '''
+    def _current_recipe(self):
+        self._parse_recipe(self.recipe)
+        return self._parsed_recipe
+
     '''
     short()
         short form representation of the Drink model
     '''
     def short(self):
-        print(json.loads(self.recipe))
-        short_recipe = [{
-            'color': r['color'],
-            'parts': r['parts']
-        } for r in json.loads(self.recipe)]
+        recipe = self._current_recipe()
+        if self._short_recipe is None:
+            self._short_recipe = [{
+                'color': r['color'],
+                'parts': r['parts']
+            } for r in recipe]
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': short_recipe
+            'recipe': self._short_recipe
         }
 
     '''
@@ -77,7 +160,7 @@ class Drink(db.Model):
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': json.loads(self.recipe)
+            'recipe': self._current_recipe()
         }
 
     '''
@@ -117,5 +200,33 @@ class Drink(db.Model):
     def update(self):
         db.session.commit()
 
+    '''
+    existing_titles(titles)
+        returns the subset of titles already used by a drink
+        queries in chunks to stay under the sqlite variable limit
+    '''
+    @classmethod
+    def existing_titles(cls, titles, chunk_size=500):
+        titles = list(titles)
+        existing = set()
+        for start in range(0, len(titles), chunk_size):
+            chunk = titles[start:start + chunk_size]
+            existing.update(title for title, in db.session.query(
+                cls.title).filter(cls.title.in_(chunk)))
+        return existing
+
+    '''
+    bulk_insert(rows)
+        inserts many drinks with one executemany and a single commit
+        each row is a dict with a title and an already encoded recipe
+        EXAMPLE
+            Drink.bulk_insert([{'title': 'Water', 'recipe': '[...]'}])
+    '''
+    @classmethod
+    def bulk_insert(cls, rows):
+        if rows:
+            db.session.execute(cls.__table__.insert(), rows)
+        db.session.commit()
+
     def __repr__(self):
         return json.dumps(self.short())
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import threading
+import time
+
+from .database.models import Drink
+
+# seconds a snapshot may be served before it is rebuilt, this bounds how
+# stale a worker can be when another process changed the menu
+MENU_CACHE_MAX_AGE = 5
+
+'''
+MenuSnapshot
+the already-encoded short and long views of the whole menu
+each view carries a strong etag derived from its content, so every
+worker process hands out the same etag for the same menu
+'''
+
+
+class MenuSnapshot:
+    def __init__(self, version, drinks):
+        self.version = version
+        self.count = len(drinks)
+        self.short_body = self._encode([drink.short() for drink in drinks])
+        self.long_body = self._encode([drink.long() for drink in drinks])
+        self.short_etag = hashlib.sha256(self.short_body).hexdigest()
+        self.long_etag = hashlib.sha256(self.long_body).hexdigest()
+        self.built_at = time.monotonic()
+
+    @staticmethod
+    def _encode(drinks):
+        return json.dumps({
+            'success': True,
+            'drinks': drinks
+        }).encode('utf-8')
+
+
+'''
+MenuCache
+process-wide cache of the menu snapshot
+reads build the snapshot once, writes invalidate it and bump the version
+'''
+
+
+class MenuCache:
+    def __init__(self, max_age=MENU_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self.version = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, snapshot):
+        return snapshot is not None and (
+            self.max_age is None or
+            time.monotonic() - snapshot.built_at < self.max_age)
+
+    def get(self):
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            return snapshot
+
+        # Only one thread rebuilds, the others wait and reuse its result
+        with self._lock:
+            if not self._is_fresh(self._snapshot):
+                drinks = Drink.query.order_by(Drink.id).all()
+                self._snapshot = MenuSnapshot(self.version, drinks)
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._snapshot = None
+
+
+menu_cache = MenuCache()
@@ -0,0 +1,103 @@
+import json
+import secrets
+import threading
+from collections import deque
+
+# number of past events kept for Last-Event-ID resume
+MENU_FEED_SIZE = 1024
+# seconds between heartbeat comments on an idle stream
+MENU_FEED_HEARTBEAT = 15
+# milliseconds clients wait before reconnecting
+MENU_FEED_RETRY = 3000
+
+'''
+MenuFeed
+in-memory ring buffer of menu changes, published by the write paths
+and replayed to Server-Sent Events clients
+event kinds are created, updated and deleted, plus reset when clients
+have to refetch the whole menu
+the feed only covers the writes of its own process. Event ids are
+<epoch>-<sequence>, the epoch is drawn per feed so that an id from another
+worker, or from before a restart, is answered with reset rather than
+with unrelated events
+'''
+
+
+class MenuFeed:
+    def __init__(self, size=MENU_FEED_SIZE, heartbeat=MENU_FEED_HEARTBEAT):
+        self.heartbeat = heartbeat
+        self.epoch = secrets.token_hex(4)
+        self.last_id = 0
+        self._events = deque(maxlen=size)
+        self._condition = threading.Condition()
+
+    def publish(self, kind, drink_id=None, drink=None):
+        with self._condition:
+            self.last_id += 1
+            self._events.append((self.last_id, kind, json.dumps({
+                'id': drink_id,
+                'drink': drink
+            })))
+            self._condition.notify_all()
+            return self.last_id
+
+    def event_id(self, sequence):
+        return '{}-{}'.format(self.epoch, sequence)
+
+    def sequence(self, event_id):
+        """Returns the sequence of an event id of this feed, else None"""
+        epoch, _, sequence = (event_id or '').partition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+    def since(self, last_event_id):
+        """Returns the events after last_event_id
+        Returns None when some of them already left the ring buffer
+        """
+        with self._condition:
+            return self._since(last_event_id)
+
+    def _since(self, last_event_id):
+        if last_event_id > self.last_id:
+            # ids from before a restart of the process
+            return None
+        oldest_id = self._events[0][0] if self._events else self.last_id + 1
+        if last_event_id < oldest_id - 1:
+            return None
+        return [event for event in self._events if event[0] > last_event_id]
+
+    def wait(self, last_event_id, timeout):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.last_id != last_event_id, timeout)
+            return self._since(last_event_id)
+
+    def stream(self, last_event_id=None):
+        """Yields the Server-Sent Events of a client connection
+        Replays what was missed since the event id last_event_id, then
+        waits for new events and sends a heartbeat comment when idle
+        """
+        yield 'retry: {}\n\n'.format(MENU_FEED_RETRY)
+        if last_event_id is None:
+            sequence = self.last_id
+        else:
+            # -1 is never found, an id of another feed gets a reset
+            sequence = self.sequence(last_event_id)
+            if sequence is None:
+                sequence = -1
+
+        while True:
+            events = self.wait(sequence, self.heartbeat)
+            if events is None:
+                sequence = self.last_id
+                yield 'id: {}\nevent: reset\ndata: {{}}\n\n'.format(
+                    self.event_id(sequence))
+            elif not events:
+                yield ': heartbeat\n\n'
+            for sequence, kind, data in events or ():
+                yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+                    self.event_id(sequence), kind, data)
+
+
+menu_feed = MenuFeed()
@@ -0,0 +1,134 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds in milliseconds of the histogram buckets
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+'''
+Histogram
+cumulative bucket counts of the durations recorded for one phase
+'''
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def observe(self, ms):
+        self.count += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def format(self):
+        buckets = {}
+        total = 0
+        for bound, count in zip(BUCKETS_MS + ('+Inf',), self.buckets):
+            total += count
+            buckets[str(bound)] = total
+        return {
+            'count': self.count,
+            'sum_ms': self.sum_ms,
+            'mean_ms': self.sum_ms / self.count if self.count else 0.0,
+            'max_ms': self.max_ms,
+            'buckets': buckets
+        }
+
+
+_histograms = {}
+_lock = threading.Lock()
+
+
+def record(phase, seconds):
+    """Adds a duration to the current request and to the phase histogram
+    A phase recorded several times in one request is summed
+    """
+    ms = seconds * 1000
+    if has_request_context():
+        timings = g.setdefault('server_timing', {})
+        timings[phase] = timings.get(phase, 0.0) + ms
+    with _lock:
+        _histograms.setdefault(phase, Histogram()).observe(ms)
+
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
+
+
+def stats():
+    with _lock:
+        return {phase: histogram.format()
+                for phase, histogram in sorted(_histograms.items())}
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start = conn.info['query_start_time'].pop()
+    # db time is only attributed to requests, not to the process histogram
+    # of unrelated work such as create_all
+    if has_request_context():
+        record('db', time.perf_counter() - start)
+
+
+def _handle_error(exception_context):
+    # failed statements never reach after_cursor_execute
+    conn = exception_context.connection
+    starts = conn.info.get('query_start_time') if conn is not None else None
+    if starts:
+        starts.pop()
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+
+
+def _add_server_timing(response):
+    if 'request_start' in g:
+        record('total', time.perf_counter() - g.request_start)
+    timings = g.get('server_timing', {})
+    response.headers['Server-Timing'] = ', '.join(
+        '{};dur={:.3f}'.format(phase, ms) for phase, ms in timings.items())
+    return response
+
+
+'''
+init_app(app)
+    records the total and database time of every request and sends the
+    collected phases back in a Server-Timing header
+'''
+
+
+def init_app(app):
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+    app.before_request(_start_request)
+    app.after_request(_add_server_timing)
@@ -0,0 +1,422 @@
+import io
+import os
+import unittest
+import json
+import sqlite3
+import tempfile
+import time
+from contextlib import redirect_stdout
+from unittest import mock
+from flask import Flask
+
+from local_idp import LocalIdentityProvider
+from src.api import app
+from src.auth import auth
+from src.database.models import setup_db, db, Drink
+from src.menu_cache import menu_cache
+from src.menu_feed import menu_feed
+
+
+class CoffeeShopTestCase(unittest.TestCase):
+    """This class represents the coffee shop test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start a local identity provider and verify tokens against it."""
+        cls.idp = LocalIdentityProvider()
+        auth.configure_jwks(cls.idp.start())
+        cls.manager_header = cls.idp.headers([
+            'get:drinks-detail',
+            'post:drinks',
+            'patch:drinks',
+            'delete:drinks',
+            'get:stats'])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.idp.stop()
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        self.app = app
+        self.client = self.app.test_client
+        fd, self.database_file = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = \
+            'sqlite:///' + self.database_file
+
+        self.new_drink = {
+            'title': 'Water',
+            'recipe': [{'name': 'water', 'color': 'blue', 'parts': 1}]
+        }
+
+        with self.app.app_context():
+            db.create_all()
+        menu_cache.invalidate()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+        os.remove(self.database_file)
+
+    def test_get_drinks_empty_menu(self):
+        """Test retrieving drinks from an empty menu"""
+        res = self.client().get('/drinks')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+
+    def test_menu_cache_invalidated_on_write(self):
+        """Test the menu snapshot is rebuilt after a write"""
+        self.client().get('/drinks')
+        version = menu_cache.version
+
+        res = self.client().post(
+            '/drinks', json=self.new_drink, headers=self.manager_header)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(menu_cache.version, version + 1)
+
+        res = self.client().get('/drinks')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["drinks"][0]["recipe"],
+                         [{'color': 'blue', 'parts': 1}])
+
+        res = self.client().get('/drinks-detail', headers=self.manager_header)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["drinks"][0]["recipe"],
+                         self.new_drink["recipe"])
+
+    def test_menu_served_from_cache(self):
+        """Test repeated reads do not rebuild the snapshot"""
+        self.client().post(
+            '/drinks', json=self.new_drink, headers=self.manager_header)
+        self.client().get('/drinks')
+        with self.app.app_context():
+            snapshot = menu_cache.get()
+            self.client().get('/drinks')
+            self.assertIs(menu_cache.get(), snapshot)
+
+    def test_304_if_menu_not_modified(self):
+        """Test a matching If-None-Match is answered with 304"""
+        self.client().post(
+            '/drinks', json=self.new_drink, headers=self.manager_header)
+        res = self.client().get('/drinks')
+        etag = res.headers['ETag']
+        self.assertTrue(etag)
+
+        res = self.client().get('/drinks', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+        self.client().post('/drinks', json={
+            'title': 'Milk',
+            'recipe': [{'name': 'milk', 'color': 'white', 'parts': 1}]
+        }, headers=self.manager_header)
+        res = self.client().get('/drinks', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_bulk_import_reports_conflicts(self):
+        """Test a bulk import inserts valid drinks and reports the rest"""
+        self.client().post(
+            '/drinks', json=self.new_drink, headers=self.manager_header)
+        drinks = [{
+            'title': 'Drink {}'.format(i),
+            'recipe': [{'name': 'milk', 'color': 'white', 'parts': i}]
+        } for i in range(100)]
+        drinks.append(self.new_drink)
+        drinks.append(drinks[0])
+        drinks.append({'title': 'No recipe'})
+
+        res = self.client().post(
+            '/drinks/bulk', json=drinks, headers=self.manager_header)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 100)
+        self.assertEqual(
+            [error['index'] for error in data['errors']], [100, 101, 102])
+        with self.app.app_context():
+            self.assertEqual(Drink.query.count(), 101)
+
+    def test_bulk_import_title_taken_during_import(self):
+        """Test a title taken after the conflict check is still reported"""
+        drinks = [{
+            'title': 'Drink {}'.format(i),
+            'recipe': [{'name': 'milk', 'color': 'white', 'parts': i}]
+        } for i in range(3)]
+        self.client().post(
+            '/drinks', json=drinks[1], headers=self.manager_header)
+
+        # the first check misses the title, as if it was taken right after
+        existing_titles = Drink.existing_titles
+        checks = []
+
+        def stale_first_check(titles):
+            checks.append(list(titles))
+            return set() if len(checks) == 1 else \
+                existing_titles(checks[-1])
+
+        with mock.patch.object(Drink, 'existing_titles',
+                               side_effect=stale_first_check):
+            res = self.client().post(
+                '/drinks/bulk', json=drinks, headers=self.manager_header)
+        data = json.loads(res.data)
+        self.assertEqual(len(checks), 2)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 2)
+        self.assertEqual(
+            [error['index'] for error in data['errors']], [1])
+        with self.app.app_context():
+            self.assertEqual(Drink.query.count(), 3)
+
+    def test_bulk_import_ndjson(self):
+        """Test a bulk import sent as an ndjson stream"""
+        body = '\n'.join(json.dumps({
+            'title': 'Drink {}'.format(i),
+            'recipe': [{'name': 'milk', 'color': 'white', 'parts': 1}]
+        }) for i in range(3))
+
+        res = self.client().post(
+            '/drinks/bulk', data=body, headers=dict(
+                self.manager_header, **{
+                    'Content-Type': 'application/x-ndjson'}))
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 3)
+        self.assertEqual(data['errors'], [])
+
+    def test_400_if_bulk_import_not_a_list(self):
+        """Test a bulk import body must be a list of drinks"""
+        res = self.client().post(
+            '/drinks/bulk', json=self.new_drink, headers=self.manager_header)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_server_timing_reports_auth_phases(self):
+        """Test authenticated responses carry per-phase Server-Timing"""
+        self.client().post(
+            '/drinks', json=self.new_drink, headers=self.manager_header)
+        menu_cache.invalidate()
+        res = self.client().get('/drinks-detail', headers=self.manager_header)
+        phases = [metric.split(';')[0]
+                  for metric in res.headers['Server-Timing'].split(', ')]
+        for phase in ('auth_header', 'token_cache', 'permissions', 'view',
+                      'db', 'total'):
+            self.assertIn(phase, phases)
+
+    def test_get_stats(self):
+        """Test the stats endpoint aggregates phase histograms"""
+        self.client().get('/drinks')
+        res = self.client().get('/internal/stats', headers=self.manager_header)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['timings']['total']['count'])
+        self.assertIn('+Inf', data['timings']['total']['buckets'])
+
+    def test_403_if_stats_permission_missing(self):
+        """Test the stats endpoint requires the get:stats permission"""
+        res = self.client().get(
+            '/internal/stats',
+            headers=self.idp.headers(['get:drinks-detail']))
+        self.assertEqual(res.status_code, 403)
+
+    def test_stream_resumes_after_last_event_id(self):
+        """Test the change feed replays events after Last-Event-ID"""
+        last_event_id = menu_feed.last_id
+        res = self.client().post(
+            '/drinks', json=self.new_drink, headers=self.manager_header)
+        drink_id = json.loads(res.data)['drinks'][0]['id']
+        self.client().delete(
+            '/drinks/{}'.format(drink_id), headers=self.manager_header)
+
+        res = self.client().get(
+            '/drinks/stream',
+            headers={'Last-Event-ID': menu_feed.event_id(last_event_id)},
+            buffered=False)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/event-stream')
+        chunks = res.response
+        self.assertTrue(next(chunks).startswith(b'retry:'))
+        created = next(chunks).decode()
+        deleted = next(chunks).decode()
+        res.close()
+
+        self.assertIn('event: created', created)
+        self.assertIn('"color": "blue"', created)
+        self.assertIn('event: deleted', deleted)
+        self.assertIn(
+            'id: {}'.format(menu_feed.event_id(last_event_id + 2)), deleted)
+
+    def test_stream_resets_on_foreign_last_event_id(self):
+        """Test an event id of another worker is answered with reset"""
+        self.client().post(
+            '/drinks', json=self.new_drink, headers=self.manager_header)
+
+        res = self.client().get(
+            '/drinks/stream',
+            headers={'Last-Event-ID': 'f0f0f0f0-1'},
+            buffered=False)
+        chunks = res.response
+        next(chunks)
+        reset = next(chunks).decode()
+        res.close()
+
+        self.assertIn('event: reset', reset)
+        self.assertIn('id: {}'.format(
+            menu_feed.event_id(menu_feed.last_id)), reset)
+
+    def test_committed_drink_without_short_form_is_not_422(self):
+        """Test a committed write is reported as such and resets the feed"""
+        last_event_id = menu_feed.last_id
+        res = self.client().post(
+            '/drinks', json={'title': 'No recipe'},
+            headers=self.manager_header)
+        self.assertEqual(res.status_code, 200)
+        events = menu_feed.since(last_event_id)
+        self.assertEqual([event[1] for event in events], ['reset'])
+
+    def test_stream_sends_heartbeat(self):
+        """Test an idle change feed sends heartbeat comments"""
+        heartbeat = menu_feed.heartbeat
+        menu_feed.heartbeat = 0.01
+        try:
+            res = self.client().get('/drinks/stream', buffered=False)
+            chunks = res.response
+            next(chunks)
+            self.assertEqual(next(chunks), b': heartbeat\n\n')
+            res.close()
+        finally:
+            menu_feed.heartbeat = heartbeat
+
+
+class SQLiteEngineProfileTestCase(unittest.TestCase):
+    """This class represents the production sqlite profile test case"""
+
+    def setUp(self):
+        """Initialize an app using the production engine profile."""
+        fd, self.database_file = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = \
+            'sqlite:///' + self.database_file
+        self.app.config["SQLITE_ENGINE_PROFILE"] = 'production'
+        setup_db(self.app)
+
+        with self.app.app_context():
+            db.create_all()
+            Drink(title='Water', recipe=json.dumps(
+                [{'name': 'water', 'color': 'blue', 'parts': 1}])).insert()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.database_file + suffix):
+                os.remove(self.database_file + suffix)
+
+    def test_pragmas_applied(self):
+        """Test connections are opened with the profile pragmas"""
+        with self.app.app_context():
+            engine = db.get_engine(self.app)
+            journal_mode = engine.execute('PRAGMA journal_mode').scalar()
+            synchronous = engine.execute('PRAGMA synchronous').scalar()
+        self.assertEqual(journal_mode, 'wal')
+        # NORMAL
+        self.assertEqual(synchronous, 1)
+
+    def test_readers_do_not_wait_behind_writer(self):
+        """Test a read completes while another connection is writing"""
+        writer = sqlite3.connect(self.database_file, isolation_level=None)
+        try:
+            writer.execute('BEGIN EXCLUSIVE')
+            writer.execute(
+                "INSERT INTO drink (title, recipe) VALUES ('Milk', '[]')")
+
+            with self.app.app_context():
+                start = time.monotonic()
+                count = Drink.query.count()
+                elapsed = time.monotonic() - start
+        finally:
+            writer.execute('ROLLBACK')
+            writer.close()
+
+        self.assertEqual(count, 1)
+        self.assertLess(elapsed, 1)
+
+
+class DrinkModelTestCase(unittest.TestCase):
+    """This class represents the drink recipe parsing test case"""
+
+    def setUp(self):
+        """Initialize an app with one drink."""
+        fd, self.database_file = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = \
+            'sqlite:///' + self.database_file
+        setup_db(self.app)
+        self.recipe = [{'name': 'water', 'color': 'blue', 'parts': 1}]
+
+        with self.app.app_context():
+            db.create_all()
+            Drink(title='Water', recipe=json.dumps(self.recipe)).insert()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+        os.remove(self.database_file)
+
+    def test_recipe_parsed_once(self):
+        """Test the recipe blob is parsed once per load, not per call"""
+        with self.app.app_context():
+            with mock.patch('src.database.models.json.loads',
+                            wraps=json.loads) as loads:
+                drink = Drink.query.one()
+                for _ in range(3):
+                    drink.short()
+                    drink.long()
+        self.assertEqual(loads.call_count, 1)
+
+    def test_recipe_reparsed_on_assignment(self):
+        """Test assigning a new recipe replaces the short and long forms"""
+        recipe = [{'name': 'milk', 'color': 'white', 'parts': 2}]
+        with self.app.app_context():
+            drink = Drink.query.one()
+            drink.short()
+            drink.recipe = json.dumps(recipe)
+            short = drink.short()
+            long = drink.long()
+        self.assertEqual(short['recipe'], [{'color': 'white', 'parts': 2}])
+        self.assertEqual(long['recipe'], recipe)
+
+    def test_recipe_reparsed_after_commit(self):
+        """Test a recipe changed in the database is seen once reloaded"""
+        with self.app.app_context():
+            drink = Drink.query.one()
+            drink.short()
+            db.session.execute(
+                Drink.__table__.update().values(recipe='[]'))
+            # expires the drink, the next read reloads the row
+            drink.update()
+            self.assertEqual(drink.short()['recipe'], [])
+
+    def test_short_does_not_print(self):
+        """Test formatting a drink writes nothing to stdout"""
+        output = io.StringIO()
+        with self.app.app_context(), redirect_stdout(output):
+            Drink.query.one().short()
+        self.assertEqual(output.getvalue(), '')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
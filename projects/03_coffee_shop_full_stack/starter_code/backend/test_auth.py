@@ -0,0 +1,158 @@
+import os
+import unittest
+import json
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from src.auth.auth import AuthError, JWKSKeyStore, TokenCache
+
+
+def jwk(kid):
+    return {
+        'kty': 'RSA',
+        'kid': kid,
+        'use': 'sig',
+        'n': 'sXchDaQebHnPiGvyDOAT4saGEUetSyo9MKLOoWFsueri23bOdgWp4Dy1Wl',
+        'e': 'AQAB'
+    }
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """This class represents the JWKS key store test case"""
+
+    def setUp(self):
+        """Write a local key set and point a key store at it."""
+        fd, self.jwks_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.write_keys('key-1')
+        self.store = JWKSKeyStore(
+            Path(self.jwks_path).as_uri(),
+            ttl=600,
+            min_refresh_interval=30)
+
+    def tearDown(self):
+        """Executed after reach test"""
+        os.remove(self.jwks_path)
+
+    def write_keys(self, *kids):
+        with open(self.jwks_path, 'w') as f:
+            json.dump({'keys': [jwk(kid) for kid in kids]}, f)
+
+    def test_known_kid_is_fetched_once(self):
+        """Test repeated lookups of a known kid only fetch the key set once"""
+        for _ in range(5):
+            rsa_key = self.store.get_key('key-1')
+        self.assertEqual(rsa_key['kid'], 'key-1')
+        self.assertEqual(self.store.fetches, 1)
+        self.assertEqual(self.store.misses, 1)
+        self.assertEqual(self.store.hits, 4)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        """Test an unknown kid only refetches once per refresh interval"""
+        self.store.get_key('key-1')
+        self.assertEqual(self.store.get_key('key-2'), {})
+        self.assertEqual(self.store.fetches, 1)
+
+        self.store.min_refresh_interval = 0
+        self.write_keys('key-1', 'key-2')
+        self.assertEqual(self.store.get_key('key-2')['kid'], 'key-2')
+        self.assertEqual(self.store.fetches, 2)
+
+    def test_keys_expire_after_ttl(self):
+        """Test the key set is refetched once the ttl has passed"""
+        self.store.ttl = 0
+        self.store.min_refresh_interval = 0
+        self.store.get_key('key-1')
+        self.store.get_key('key-1')
+        self.assertEqual(self.store.fetches, 2)
+        self.assertEqual(self.store.hits, 0)
+
+    def test_expired_keys_refetch_is_rate_limited(self):
+        """Test expired keys are served until the refresh interval passed"""
+        self.store.ttl = 0
+        self.store.get_key('key-1')
+        self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.assertEqual(self.store.fetches, 1)
+
+    def test_concurrent_lookups_wait_for_the_fetch(self):
+        """Test requests without a key wait for the fetch in flight"""
+        fetch = self.store._fetch
+
+        def slow_fetch():
+            time.sleep(0.3)
+            return fetch()
+
+        self.store._fetch = slow_fetch
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(self.store.get_key('key-1')))
+            for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([key['kid'] for key in results], ['key-1'] * 5)
+        self.assertEqual(self.store.fetches, 1)
+
+    def test_failed_fetch_serves_previous_keys(self):
+        """Test the last fetched keys are kept when the endpoint fails"""
+        self.store.ttl = 0
+        self.store.min_refresh_interval = 0
+        self.store.get_key('key-1')
+        with open(self.jwks_path, 'w') as f:
+            f.write('<html>unavailable</html>')
+        self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.assertEqual(self.store.fetches, 2)
+
+    def test_failed_fetch_without_keys_raises_auth_error(self):
+        """Test a failing endpoint is an auth error and is rate limited"""
+        os.remove(self.jwks_path)
+        for _ in range(2):
+            with self.assertRaises(AuthError) as raised:
+                self.store.get_key('key-1')
+            self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(self.store.fetches, 1)
+        self.write_keys('key-1')
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified token cache test case"""
+
+    def setUp(self):
+        """Define test variables."""
+        self.cache = TokenCache(maxsize=2)
+        self.payload = {
+            'exp': time.time() + 3600,
+            'permissions': ['get:drinks-detail']
+        }
+
+    def test_cached_payload_is_returned(self):
+        """Test a stored payload is returned and counted as a hit"""
+        self.assertIsNone(self.cache.get('token-a'))
+        self.cache.put('token-a', self.payload)
+        self.assertEqual(self.cache.get('token-a'), self.payload)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_expired_payload_is_dropped(self):
+        """Test an entry never outlives the exp claim of its token"""
+        self.cache.put('token-a', {'exp': time.time() - 1})
+        self.assertIsNone(self.cache.get('token-a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        """Test the cache keeps at most maxsize entries"""
+        self.cache.put('token-a', self.payload)
+        self.cache.put('token-b', self.payload)
+        self.cache.get('token-a')
+        self.cache.put('token-c', self.payload)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get('token-b'))
+        self.assertIsNotNone(self.cache.get('token-a'))
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()